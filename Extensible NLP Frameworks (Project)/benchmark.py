@@ -0,0 +1,259 @@
+"""
+File: benchmark.py
+
+Description: Benchmark harness for the GovSnatch framework.
+Generates synthetic news-like corpora of several sizes and times
+each stage of the pipeline separately (stop words, read, tokenize,
+n-grams, approximate bigram counting, sentiment, full parse with and
+without mmap, figure construction, and saving / loading the analyzed
+corpus as a snapshot against pickle), along with the memory each stage
+allocates at its peak. Results are appended as JSON lines so runs can
+be compared across commits.
+
+Runs offline and headless:
+    python benchmark.py --sizes small medium --output bench.jsonl
+
+Tracing memory makes allocation heavy stages several times slower, so
+compare timings only between runs with the same 'memory traced' setting,
+and use --no-trace-memory for timings alone.
+
+"""
+
+
+import argparse
+import json
+import os
+import pickle
+import subprocess
+import tempfile
+import time
+
+import matplotlib
+matplotlib.use('Agg')  # never open a window
+import matplotlib.pyplot as plt
+import numpy as np
+import textblob as tb
+
+from instrumentation import TracedPeak, peak_rss_kb
+from new_textastic import GovSnatch
+from sketches import HeavyHitters, sketch_report
+
+
+# name -> (total corpus size in bytes, number of documents)
+SIZES = {
+    'small': (1 << 20, 10),
+    'medium': (10 << 20, 100),
+    'large': (100 << 20, 1000),
+    'huge': (1 << 30, 10000),
+}
+
+STOPWORDS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stopwords.txt')
+
+SENTIMENT_WORDS = ['good', 'bad', 'great', 'terrible', 'not', 'very', 'new', 'strong',
+                   'weak', 'illegal', 'legal', 'fair', 'unfair', 'important', 'really']
+
+
+def make_corpus(directory, total_bytes, num_docs, seed=0):
+    """ Write num_docs synthetic articles adding up to about total_bytes.
+    Words follow a Zipf distribution mixed with stop words and sentiment
+    words, in sentences and paragraphs. Returns a filename -> label dict """
+    rng = np.random.default_rng(seed)
+    with open(STOPWORDS) as f:
+        stop_words = [word.strip() for word in f if word.strip()]
+    vocab = np.array([f'term{i}' for i in range(50000)] + stop_words * 200 + SENTIMENT_WORDS * 100)
+    weights = 1.0 / np.arange(1, len(vocab) + 1)
+    weights /= weights.sum()
+
+    mapping = {}
+    doc_bytes = total_bytes // num_docs
+    for d in range(num_docs):
+        filename = os.path.join(directory, f'doc{d:05d}_{"conservative" if d % 2 else "liberal"}.txt')
+        with open(filename, 'w', encoding='utf-8') as f:
+            written = 0
+            while written < doc_bytes:
+                # one paragraph of a few sentences
+                lengths = rng.integers(8, 25, size=5)
+                words = rng.choice(vocab, size=lengths.sum(), p=weights)
+                sentences = np.split(words, np.cumsum(lengths)[:-1])
+                paragraph = ' '.join(' '.join(s).capitalize() + '.' for s in sentences) + '\n'
+                f.write(paragraph)
+                written += len(paragraph)
+        mapping[filename] = f'Doc {d} ({"Conservative" if d % 2 else "Liberal"})'
+    return mapping
+
+
+def git_commit():
+    """ The current commit of the repository, if there is one """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def directory_size(path):
+    """ Total size of the files in a directory, in bytes """
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+def pickle_save(analyzer, path):
+    with open(path, 'wb') as f:
+        pickle.dump({kind: dict(values.items()) for kind, values in analyzer.data.items()}, f,
+                    pickle.HIGHEST_PROTOCOL)
+
+
+def pickle_load(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def sketch_bigrams(tokenizer, ids):
+    """ Count the bigrams of ids in a HeavyHitters sized for the document,
+    as GovSnatch(ngram_sketch={}) does """
+    sketch = HeavyHitters(items=max(len(ids) - 1, 1))
+    for batch in tokenizer.ngram_batches(ids, 2):
+        sketch.update_batch(*batch)
+    return sketch
+
+
+def summarize_sketches(reports):
+    """ Corpus totals of the per-document sketch_report dicts """
+    return {
+        'exact bytes': sum(report['exact bytes'] for report in reports),
+        'sketch bytes': sum(report['sketch bytes'] for report in reports),
+        'min top k recall': min(report['top k recall'] for report in reports),
+        'max top k error': max(report['max top k error'] for report in reports),
+    }
+
+
+class StageTimer:
+    """ Accumulates wall time per stage over many documents, and the most
+    memory any one run of a stage allocated on top of what was already in
+    use (see TracedPeak). Tracing memory slows down allocation heavy stages,
+    so it can be left off to time them alone """
+
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.seconds = {}
+        self.peak = {}
+
+    def time(self, stage, func, *args, **kwargs):
+        with TracedPeak(start=self.trace_memory) as memory:
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + time.perf_counter() - start
+        if memory.peak is not None:
+            self.peak[stage] = max(self.peak.get(stage, 0), memory.peak // 1024)
+        return result
+
+
+def run(size, mapping, max_figure_docs=50, trace_memory=True):
+    """ Time every stage on one corpus and return a list of result records """
+    timer = StageTimer(trace_memory)
+    analyzer = GovSnatch()
+    timer.time('load_stop_words', analyzer.load_stop_words, STOPWORDS)
+    tokenizer = analyzer.tokenizer
+
+    corpus_bytes = 0
+    sketch_reports = []
+    for filename, label in mapping.items():
+        # each stage on its own, as simple_text_parser chains them
+        with open(filename, 'rb') as f:
+            text = timer.time('read', f.read).decode('utf-8')
+        corpus_bytes += len(text)
+        ids = timer.time('tokenize', tokenizer.tokenize, text)
+        for n in (1, 2, 3):
+            timer.time('ngrams', tokenizer.ngram_counts, ids, n)
+        sketch = timer.time('ngram_sketch', sketch_bigrams, tokenizer, ids)
+        sketch_reports.append(sketch_report(tokenizer.ngram_counts(ids, 2), sketch))
+
+        def sentiment():
+            sentences = tb.TextBlob(text).sentences
+            return analyzer.sentiment.score([sentence.raw for sentence in sentences])
+        timer.time('sentiment', sentiment)
+
+        # then the whole parser, as load_text runs it. Its sentiment is scored
+        # lazily; score it here, like mmap_text_parser does, and not in
+        # whichever figure first reads it
+        def simple_text_parser():
+            results = analyzer.simple_text_parser(filename)
+            results['sentiment'].evaluate()
+            return results
+        results = timer.time('simple_text_parser', simple_text_parser)
+        timer.time('mmap_text_parser', analyzer.mmap_text_parser, filename)
+        if len(analyzer.metrics) < max_figure_docs:
+            analyzer.add_document(label, results)
+
+    timer.time('wordcount_sankey', analyzer.wordcount_sankey, k=5, show=False)
+    timer.time('bigram_visualization', analyzer.bigram_visualization, show=False)
+    timer.time('compare_documents', analyzer.compare_documents, k=15, show=False)
+    plt.close('all')
+
+    # shipping the analyzed corpus: snapshot directory against pickled Counters
+    output_bytes = {}
+    with tempfile.TemporaryDirectory() as directory:
+        snapshot_path = os.path.join(directory, 'snapshot')
+        pickle_path = os.path.join(directory, 'data.pkl')
+        timer.time('snapshot_save', analyzer.save, snapshot_path)
+        loaded = timer.time('snapshot_load', GovSnatch.load, snapshot_path)
+        # the first corpus-wide query decodes the word totals stored in the snapshot
+        timer.time('snapshot_first_top_k', lambda: loaded.stats.top_k('wordcount', 15))
+        timer.time('pickle_save', pickle_save, analyzer, pickle_path)
+        timer.time('pickle_load', pickle_load, pickle_path)
+        output_bytes['snapshot_save'] = directory_size(snapshot_path)
+        output_bytes['pickle_save'] = os.path.getsize(pickle_path)
+
+    sketches = summarize_sketches(sketch_reports)
+    process_peak = peak_rss_kb()
+    commit = git_commit()
+    return [{
+        'commit': commit,
+        'timestamp': time.time(),
+        'size': size,
+        'documents': len(mapping),
+        'bytes': corpus_bytes,
+        'figure documents': len(analyzer.metrics),
+        'stage': stage,
+        'seconds': seconds,
+        'mb per second': corpus_bytes / seconds / 2 ** 20 if seconds > 0 else None,
+        'memory traced': trace_memory,
+        'peak traced kb': timer.peak.get(stage),
+        'process peak rss kb': process_peak,
+        'output bytes': output_bytes.get(stage),
+        'sketch': sketches if stage == 'ngram_sketch' else None,
+    } for stage, seconds in timer.seconds.items()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', choices=SIZES, default=['small'])
+    parser.add_argument('--output', default='bench_results.jsonl', help='JSON lines file to append to')
+    parser.add_argument('--max-figure-docs', type=int, default=50,
+                        help='documents included in the figures (grids of thousands are not useful)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-trace-memory', dest='trace_memory', action='store_false',
+                        help='skip the per-stage memory peaks, which slow some stages down')
+    args = parser.parse_args(argv)
+
+    for size in args.sizes:
+        total_bytes, num_docs = SIZES[size]
+        with tempfile.TemporaryDirectory() as directory:
+            mapping = make_corpus(directory, total_bytes, num_docs, args.seed)
+            records = run(size, mapping, args.max_figure_docs, args.trace_memory)
+
+        with open(args.output, 'a') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+        for record in records:
+            written = f"  wrote {record['output bytes'] / 2 ** 20:8.2f} MB" if record['output bytes'] else ''
+            peak = f"  peak {record['peak traced kb'] / 1024:8.1f} MB" if record['peak traced kb'] is not None else ''
+            print(f"{size:>6} {record['stage']:<22} {record['seconds']:9.3f}s{peak}{written}")
+            if record['sketch']:
+                sketch = record['sketch']
+                print(f"{'':>6} {'':<22} bigram sketches {sketch['sketch bytes'] / 2 ** 20:.2f} MB "
+                      f"against {sketch['exact bytes'] / 2 ** 20:.2f} MB exact, top k recall "
+                      f">= {sketch['min top k recall']:.2f}, error <= {sketch['max top k error']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+"""
+File: corpus_stats.py
+
+Description: Corpus-wide n-gram totals that are kept up to date as
+documents are added to or removed from a GovSnatch instance, so
+global queries cost O(document size) to maintain instead of a
+full rebuild over the corpus. TermIndex keeps per-document top-k
+lists and an inverted index so figures can be drawn in time
+proportional to their size.
+
+"""
+
+
+import heapq
+from operator import itemgetter
+
+
+class RunningTopK:
+    """ Running totals of terms with a maintained top-k structure.
+
+    Every change to a total pushes a fresh entry on a max-heap; entries
+    that no longer match the current total are discarded lazily when the
+    top of the heap is read. Ties are broken by the order terms were first
+    seen, like Counter.most_common.
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self._first_seen = {}
+        self._seq = 0
+        self._heap = []  # (-count, first seen, term), possibly stale
+
+    def update(self, counter, sign=1):
+        """ Add (sign=1) or subtract (sign=-1) the counts of one document """
+        if sign > 0 and not self.counts:
+            # loading into an empty structure: one heapify instead of a push per term
+            self.counts = {term: count for term, count in counter.items() if count > 0}
+            self._first_seen = {term: seq for seq, term in enumerate(self.counts, self._seq)}
+            self._seq += len(self.counts)
+            self._heap = [(-count, self._first_seen[term], term) for term, count in self.counts.items()]
+            heapq.heapify(self._heap)
+            return
+
+        for term, count in counter.items():
+            total = self.counts.get(term, 0) + sign * count
+            if total > 0:
+                if term not in self._first_seen:
+                    self._first_seen[term] = self._seq
+                    self._seq += 1
+                self.counts[term] = total
+                heapq.heappush(self._heap, (-total, self._first_seen[term], term))
+            elif term in self.counts:
+                del self.counts[term]
+                del self._first_seen[term]
+
+        # stale entries pile up as totals change, so rebuild now and then
+        if len(self._heap) > 2 * len(self.counts) + 64:
+            self._heap = [(-count, self._first_seen[term], term) for term, count in self.counts.items()]
+            heapq.heapify(self._heap)
+
+    def most_common(self, k):
+        """ The k terms with the highest totals, as (term, count) pairs """
+        result = []
+        seen = set()
+        while self._heap and len(result) < k:
+            entry = heapq.heappop(self._heap)
+            count, seq, term = -entry[0], entry[1], entry[2]
+            if term in seen or self.counts.get(term) != count or self._first_seen[term] != seq:
+                continue
+            seen.add(term)
+            result.append((term, count))
+
+        # put the live entries back for the next query
+        for term, count in result:
+            heapq.heappush(self._heap, (-count, self._first_seen[term], term))
+        return result
+
+    def __getitem__(self, term):
+        return self.counts.get(term, 0)
+
+    def __len__(self):
+        return len(self.counts)
+
+
+class CorpusStats:
+    """ Running word, bigram and trigram totals across every document """
+
+    KINDS = ('wordcount', 'bigramcount', 'trigramcount')
+
+    def __init__(self):
+        self.totals = {kind: RunningTopK() for kind in self.KINDS}
+        # changes put off until their kind is first queried: (loader, sign)
+        self._pending = {}
+        # bumped on every change, so derived results can tell when they are stale
+        self.version = 0
+
+    def _update(self, kind, loader, sign):
+        if kind in self._pending:
+            self._pending[kind].append((loader, sign))
+        else:
+            self.totals[kind].update(loader(), sign)
+
+    def _kind(self, kind):
+        """ The totals of one kind, with any put off changes applied """
+        for loader, sign in self._pending.pop(kind, ()):
+            self.totals[kind].update(loader(), sign)
+        return self.totals[kind]
+
+    def add(self, results):
+        """ Account for the parse results of a new document """
+        for kind in self.KINDS:
+            if kind in results:
+                self._update(kind, lambda counts=results[kind]: counts, 1)
+        self.version += 1
+
+    def add_totals(self, kind, loader):
+        """ Account for counts of one kind summed over many documents, which
+        loader() returns the first time that kind is queried """
+        self._pending.setdefault(kind, []).append((loader, 1))
+        self.version += 1
+
+    def remove(self, results):
+        """ Take the parse results of a removed document back out """
+        for kind in self.KINDS:
+            if kind in results:
+                self._update(kind, lambda counts=results[kind]: counts, -1)
+        self.version += 1
+
+    def top_k(self, kind, k):
+        """ The k most common terms of one kind across the corpus """
+        return self._kind(kind).most_common(k)
+
+
+class TermIndex:
+    """ Per-document term counts sorted once at load time, plus an inverted
+    index of term -> {document: count}.
+
+    top_k(label, k) is a slice of the sorted counts, and the counts of a set
+    of terms are read from their postings, so neither touches documents or
+    terms that do not end up in the answer.
+    """
+
+    def __init__(self):
+        self.ranked = {}    # label -> [(term, count)] by count, ties in first-seen order
+        self.postings = {}  # term -> {label: count}
+
+    def add(self, label, counter):
+        """ Index the counts of a document. Sorted like Counter.most_common """
+        if label in self.ranked:
+            self.remove(label)
+        self.ranked[label] = sorted(((term, count) for term, count in counter.items() if count > 0),
+                                    key=itemgetter(1), reverse=True)
+        for term, count in self.ranked[label]:
+            self.postings.setdefault(term, {})[label] = count
+
+    def remove(self, label):
+        """ Drop a document from the index """
+        for term, _ in self.ranked.pop(label):
+            documents = self.postings[term]
+            del documents[label]
+            if not documents:
+                del self.postings[term]
+
+    def top_k(self, label, k):
+        """ The k most common (term, count) pairs of one document """
+        return self.ranked[label][:max(k, 0)]
+
+    def documents(self, term):
+        """ label -> count for every document containing term """
+        return self.postings.get(term, {})
+
+    def __contains__(self, label):
+        return label in self.ranked
@@ -0,0 +1,253 @@
+"""
+File: corpus_store.py
+
+Description: An optional backing store for the n-gram counts in
+GovSnatch.data. Terms are interned into integer ids and counts are
+kept as sparse CSR matrices with one row per document, so corpus-wide
+totals, top-k queries and frequency tables are vectorized.
+
+"""
+
+
+from collections import Counter
+from collections.abc import Mapping, MutableMapping
+
+import numpy as np
+from scipy import sparse
+
+
+class Vocabulary:
+    """ Interns terms into consecutive integer ids, in first-seen order """
+
+    def __init__(self):
+        self.ids = {}
+        self.terms = []
+
+    def intern(self, term):
+        """ Return the id of a term, assigning a new one if it is unseen """
+        term_id = self.ids.get(term)
+        if term_id is None:
+            term_id = self.ids[term] = len(self.terms)
+            self.terms.append(term)
+        return term_id
+
+    def get(self, term, default=-1):
+        return self.ids.get(term, default)
+
+    def __contains__(self, term):
+        return term in self.ids
+
+    def __len__(self):
+        return len(self.terms)
+
+
+class CountMatrix:
+    """ Counts of one kind of term (words, bigrams or trigrams) for every
+    document, stored row by row and assembled into a CSR matrix on demand.
+
+    N-gram terms are coded as tuples of word ids from the shared word
+    vocabulary, so each distinct word string is stored once.
+    """
+
+    def __init__(self, words, order=1):
+        """ Constructor
+
+        Parameters:
+        - words: Word Vocabulary shared by every CountMatrix of a store
+        - order: 1 for words, 2 for bigrams, 3 for trigrams
+        """
+        self.words = words
+        self.order = order
+        self.vocab = words if order == 1 else Vocabulary()
+        self.labels = []
+        self.rows = {}  # label -> (term ids, counts), in the counter's order
+        self._csr = None
+
+    def encode(self, term):
+        """ Intern a term (a word, or a tuple of words for n-grams) """
+        if self.order == 1:
+            return self.words.intern(term)
+        return self.vocab.intern(tuple(self.words.intern(word) for word in term))
+
+    def decode(self, term_id):
+        """ Turn a term id back into a word or a tuple of words """
+        if self.order == 1:
+            return self.words.terms[term_id]
+        return tuple(self.words.terms[i] for i in self.vocab.terms[term_id])
+
+    def lookup(self, term):
+        """ The id of a term, or -1 if it never occurred """
+        if self.order == 1:
+            return self.words.get(term)
+        codes = tuple(self.words.get(word) for word in term)
+        return -1 if -1 in codes else self.vocab.get(codes)
+
+    def add(self, label, counter):
+        """ Store the counts of a document, replacing any previous row for label """
+        items = [(self.encode(term), count) for term, count in counter.items() if count > 0]
+        ids = np.fromiter((term_id for term_id, _ in items), dtype=np.int64, count=len(items))
+        counts = np.fromiter((count for _, count in items), dtype=np.int64, count=len(items))
+        if label not in self.rows:
+            self.labels.append(label)
+        self.rows[label] = (ids, counts)
+        self._csr = None
+
+    def remove(self, label):
+        """ Drop the row of a document """
+        del self.rows[label]
+        self.labels.remove(label)
+        self._csr = None
+
+    def matrix(self):
+        """ The documents x terms count matrix, rows in self.labels order """
+        if self._csr is None:
+            rows = [self.rows[label] for label in self.labels]
+            indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+            indptr[1:] = np.cumsum([len(ids) for ids, _ in rows])
+            if rows:
+                indices = np.concatenate([ids for ids, _ in rows])
+                data = np.concatenate([counts for _, counts in rows])
+            else:
+                indices = np.zeros(0, dtype=np.int64)
+                data = np.zeros(0, dtype=np.int64)
+            self._csr = sparse.csr_matrix((data, indices, indptr),
+                                          shape=(len(rows), len(self.vocab)))
+        return self._csr
+
+    def totals(self):
+        """ Total count of every term id across all documents """
+        return np.asarray(self.matrix().sum(axis=0)).ravel()
+
+    def top_k(self, k, label=None):
+        """ The k most common (term, count) pairs of one document, or of the
+        whole corpus if label is None. Ties keep first-seen order, like
+        Counter.most_common """
+        if k is not None and k <= 0:
+            return []
+        if label is None:
+            counts = self.totals()
+            ids = np.arange(len(counts))
+        else:
+            ids, counts = self.rows[label]
+        if k is None or k >= len(counts):
+            order = np.argsort(-counts, kind='stable')
+        else:
+            # partition first so only the candidates are fully sorted
+            threshold = np.partition(counts, len(counts) - k)[len(counts) - k]
+            candidates = np.flatnonzero(counts >= threshold)
+            order = candidates[np.argsort(-counts[candidates], kind='stable')][:k]
+        return [(self.decode(ids[i]), int(counts[i])) for i in order if counts[i] > 0]
+
+    def frequencies(self, terms):
+        """ A documents x terms array of counts, rows in self.labels order """
+        term_ids = np.array([self.lookup(term) for term in terms], dtype=np.int64)
+        known = term_ids >= 0
+        table = np.zeros((len(self.labels), len(terms)), dtype=np.int64)
+        if known.any():
+            table[:, known] = self.matrix()[:, term_ids[known]].toarray()
+        return table
+
+
+class RowCounter(Mapping):
+    """ A read-only, Counter-like view of one document's row """
+
+    def __init__(self, counts, label):
+        self._counts = counts
+        self._label = label
+        self._lookup = None
+
+    def _row(self):
+        if self._lookup is None:
+            ids, counts = self._counts.rows[self._label]
+            self._lookup = dict(zip(ids.tolist(), counts.tolist()))
+        return self._lookup
+
+    def __getitem__(self, term):
+        # missing terms count as zero, like Counter
+        return self._row().get(self._counts.lookup(term), 0)
+
+    def __contains__(self, term):
+        return self._counts.lookup(term) in self._row()
+
+    def __iter__(self):
+        ids, _ = self._counts.rows[self._label]
+        return (self._counts.decode(term_id) for term_id in ids.tolist())
+
+    def __len__(self):
+        return len(self._counts.rows[self._label][0])
+
+    def get(self, term, default=None):
+        term_id = self._counts.lookup(term)
+        return self._row().get(term_id, default)
+
+    def most_common(self, n=None):
+        return self._counts.top_k(n, self._label)
+
+    def total(self):
+        return int(self._counts.rows[self._label][1].sum())
+
+    def to_counter(self):
+        """ A standalone Counter copy of the row, in the row's order """
+        return Counter(dict(self.items()))
+
+
+class CounterView(MutableMapping):
+    """ Dict-like view of a CountMatrix mapping label -> RowCounter, so it
+    can stand in for one entry of GovSnatch.data """
+
+    def __init__(self, counts):
+        self.counts = counts
+
+    def __getitem__(self, label):
+        if label not in self.counts.rows:
+            raise KeyError(label)
+        return RowCounter(self.counts, label)
+
+    def __setitem__(self, label, counter):
+        self.counts.add(label, counter)
+
+    def __delitem__(self, label):
+        if label not in self.counts.rows:
+            raise KeyError(label)
+        self.counts.remove(label)
+
+    def pop(self, label, *default):
+        """ Remove a document and return its counts as a plain Counter,
+        since a RowCounter cannot outlive its row """
+        if label not in self.counts.rows:
+            if default:
+                return default[0]
+            raise KeyError(label)
+        counter = RowCounter(self.counts, label).to_counter()
+        self.counts.remove(label)
+        return counter
+
+    def __iter__(self):
+        return iter(list(self.counts.labels))
+
+    def __len__(self):
+        return len(self.counts.labels)
+
+
+class SparseCorpusStore:
+    """ Holds the word, bigram and trigram counts of a corpus as sparse
+    matrices sharing one word vocabulary """
+
+    KINDS = {'wordcount': 1, 'bigramcount': 2, 'trigramcount': 3}
+
+    def __init__(self):
+        self.words = Vocabulary()
+        self.counts = {kind: CountMatrix(self.words, order) for kind, order in self.KINDS.items()}
+
+    def view(self, kind):
+        """ A dict-like view of one kind of counts, for GovSnatch.data """
+        return CounterView(self.counts[kind])
+
+    def top_k(self, kind, k, label=None):
+        """ The k most common terms of a document, or of the whole corpus """
+        return self.counts[kind].top_k(k, label)
+
+    def frequencies(self, kind, terms):
+        """ A documents x terms count table and the document labels of its rows """
+        counts = self.counts[kind]
+        return counts.frequencies(terms), list(counts.labels)
@@ -0,0 +1,138 @@
+"""
+File: export.py
+
+Description: Headless export of GovSnatch visualizations for
+unattended report generation. Figures are built without an
+interactive backend and written as PNG, SVG or HTML; batches of
+document subsets are rendered in parallel worker processes.
+
+PNG and SVG images of the plotly figures (the sankey) need the optional
+kaleido package (pip install kaleido); HTML works without it.
+
+"""
+
+
+from concurrent.futures import ProcessPoolExecutor
+import io
+import os
+
+import matplotlib
+matplotlib.use('Agg')  # never open a window
+import matplotlib.pyplot as plt
+import plotly.graph_objects as go
+
+try:
+    import kaleido
+except ImportError:  # optional, only for static plotly images
+    kaleido = None
+
+
+# output name -> (GovSnatch method, default options), named like the
+# figures checked in next to main.py
+FIGURES = {
+    'sankey': ('wordcount_sankey', {'k': 3}),
+    'bar_plot': ('bigram_visualization', {'top_n': 8}),
+    'comparative_words': ('compare_documents', {'k': 15}),
+}
+
+# the figures drawn with plotly rather than matplotlib
+PLOTLY_FIGURES = ('sankey',)
+
+
+def check_formats(figures, formats):
+    """ Raise ImportError before anything is rendered if static images of
+    plotly figures are asked for and kaleido is not installed """
+    static = [fmt for fmt in formats if fmt != 'html']
+    plotly = [name for name in figures if name in PLOTLY_FIGURES]
+    if kaleido is None and static and plotly:
+        raise ImportError(f"Writing {', '.join(plotly)} as {', '.join(static)} needs the kaleido "
+                          "package (pip install kaleido), or export it as 'html' instead")
+
+
+def save_figure(fig, path):
+    """ Write a plotly or matplotlib figure to path, in the format given by
+    its extension (.png, .svg or .html). Static plotly images need the
+    kaleido package """
+    extension = os.path.splitext(path)[1].lower()
+    if isinstance(fig, go.Figure):
+        if extension == '.html':
+            fig.write_html(path, include_plotlyjs='cdn')
+        elif kaleido is None:
+            raise ImportError(f'Writing a plotly figure as {extension} needs the kaleido package '
+                              '(pip install kaleido), or save it as .html instead')
+        else:
+            fig.write_image(path)
+        return
+
+    if extension == '.html':
+        # embed the figure as inline SVG in a minimal page
+        svg = io.StringIO()
+        fig.savefig(svg, format='svg', bbox_inches='tight')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('<!DOCTYPE html>\n<html><body>\n' + svg.getvalue() + '\n</body></html>\n')
+    else:
+        fig.savefig(path, bbox_inches='tight')
+
+
+def export_figures(analyzer, directory, figures=tuple(FIGURES), formats=('png',), prefix='', options=None):
+    """ Build figures of an analyzer without showing them and write them out.
+
+    Parameters:
+    - analyzer: A GovSnatch with documents loaded
+    - directory: Folder to write into (created if missing)
+    - figures: Names from FIGURES to export
+    - formats: File formats, any of 'png', 'svg', 'html'
+    - prefix: Added to the start of every file name
+    - options: Optional dict of figure name -> keyword arguments for its method
+
+    Returns:
+    - List of the paths written
+    """
+    check_formats(figures, formats)
+    os.makedirs(directory, exist_ok=True)
+    options = options or {}
+    paths = []
+    for name in figures:
+        method, defaults = FIGURES[name]
+        fig = getattr(analyzer, method)(show=False, **{**defaults, **options.get(name, {})})
+        for fmt in formats:
+            path = os.path.join(directory, f'{prefix}{name}.{fmt}')
+            save_figure(fig, path)
+            paths.append(path)
+        if not isinstance(fig, go.Figure):
+            plt.close(fig)
+    return paths
+
+
+def export_batch(analyzer, subsets, directory, figures=tuple(FIGURES), formats=('png',),
+                 options=None, workers=None):
+    """ Export the figures of many document subsets in parallel.
+
+    Parameters:
+    - analyzer: A GovSnatch with documents loaded
+    - subsets: dict of report name -> list of document labels; each report is
+      written to its own sub folder of directory
+    - workers: Number of worker processes (default: os.cpu_count()),
+      1 renders in this process
+
+    Returns:
+    - dict of report name -> list of paths written
+    """
+    check_formats(figures, formats)
+    jobs = [(analyzer.subset(labels), os.path.join(directory, name), figures, formats, options)
+            for name, labels in subsets.items()]
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(jobs))
+    if workers <= 1:
+        return {name: _render(job) for name, job in zip(subsets, jobs)}
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return dict(zip(subsets, pool.map(_render, jobs)))
+
+
+def _render(job):
+    """ Export the figures of one subset, inside an export_batch worker """
+    analyzer, directory, figures, formats, options = job
+    return export_figures(analyzer, directory, figures, formats, options=options)
@@ -0,0 +1,171 @@
+"""
+File: instrumentation.py
+
+Description: Per-document profiling for GovSnatch parsers. A Profile
+times the stages of one parse; the finished record (a plain dict) is
+handed to a metrics sink, which is any callable taking that dict.
+GovSnatch has no sink by default, so nothing is printed or logged
+unless one is given.
+
+A record looks like:
+    {'event': 'parse', 'document': 'foxnews.txt', 'parser': 'simple_text_parser',
+     'seconds': {'read': 0.001, 'tokenize': 0.004, 'ngrams': 0.01},
+     'characters': 7860, 'tokens': 1302, 'vocabulary': 611,
+     'total vocabulary': 4120, 'peak traced kb': 2210,
+     'process peak rss kb': 153400}
+'peak traced kb' is the most memory the parse allocated on top of what
+was in use when it began (see TracedPeak), present only when memory is
+traced, e.g. GovSnatch(sink=..., trace_memory=True). 'process peak rss kb' is the largest resident size of the whole
+process so far, not of this document. Lazily scored sentiment is
+reported later in its own record, with 'event': 'sentiment', when it
+actually runs.
+
+"""
+
+
+from contextlib import contextmanager
+import json
+import logging
+import sys
+import threading
+import time
+import tracemalloc
+import weakref
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def peak_rss_kb():
+    """ Peak resident set size of this process so far, in kilobytes,
+    or None where the platform cannot tell """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+class TracedPeak:
+    """ The most memory a block of code allocated on top of what was in use
+    when it began, traced with tracemalloc. Use it as a context manager, or
+    call begin() and end(); peak is then in bytes, or None if nothing was
+    traced.
+
+    tracemalloc keeps a single peak for the process, so it is never reset
+    without first passing the peak so far to every measurement still running.
+    Measurements can therefore nest or overlap across threads, although
+    allocations by other threads count towards each one running at the time.
+    With start=True tracing is switched on if needed, and off again once no
+    measurement is running """
+
+    _lock = threading.Lock()
+    _running = weakref.WeakSet()  # measurements begun and not yet ended
+    _started = False  # whether tracing was switched on by a measurement
+
+    def __init__(self, start=False):
+        self.start = start
+        self.peak = None
+        self._base = 0
+        self._max = 0
+
+    @classmethod
+    def _collect(cls):
+        """ Pass the peak so far to every running measurement, then reset it """
+        peak = tracemalloc.get_traced_memory()[1]
+        for measurement in list(cls._running):
+            measurement._max = max(measurement._max, peak)
+        tracemalloc.reset_peak()
+
+    def begin(self):
+        with TracedPeak._lock:
+            if self.start and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                TracedPeak._started = True
+            if tracemalloc.is_tracing():
+                self._collect()
+                self._base = self._max = tracemalloc.get_traced_memory()[0]
+                TracedPeak._running.add(self)
+        return self
+
+    def end(self):
+        with TracedPeak._lock:
+            if self in TracedPeak._running:
+                if tracemalloc.is_tracing():
+                    self._collect()
+                    self.peak = self._max - self._base
+                TracedPeak._running.discard(self)
+            if TracedPeak._started and not TracedPeak._running:
+                tracemalloc.stop()
+                TracedPeak._started = False
+        return self.peak
+
+    def __enter__(self):
+        return self.begin()
+
+    def __exit__(self, *exc_info):
+        self.end()
+
+
+class Profile:
+    """ Stage timings, counts and peak memory for one document. Memory is
+    measured whenever tracemalloc is tracing; trace=True switches tracing on
+    until the profile is finished """
+
+    def __init__(self, event, document, trace=False, **fields):
+        self.record = {'event': event, 'document': document, 'seconds': {}, **fields}
+        self.memory = TracedPeak(start=trace).begin()
+
+    @contextmanager
+    def stage(self, name):
+        """ Time the body of a with block, adding to any earlier time of the same stage """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = self.record['seconds']
+            seconds[name] = seconds.get(name, 0.0) + time.perf_counter() - start
+
+    def finish(self, **fields):
+        """ Add the final counts and memory figures and return the record """
+        self.record.update(fields)
+        if self.memory.end() is not None:
+            self.record['peak traced kb'] = self.memory.peak // 1024
+        self.record['process peak rss kb'] = peak_rss_kb()
+        return self.record
+
+
+class RecordingSink:
+    """ A sink that keeps every record in a list, e.g. for tests or notebooks """
+
+    def __init__(self):
+        self.records = []
+
+    def __call__(self, record):
+        self.records.append(record)
+
+
+class LoggingSink:
+    """ A sink that writes one compact line per record to a logger """
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger('govsnatch')
+        self.level = level
+
+    def __call__(self, record):
+        stages = ' '.join(f'{stage}={seconds * 1000:.1f}ms' for stage, seconds in record['seconds'].items())
+        counts = ' '.join(f'{key}={value}' for key, value in record.items()
+                          if key not in ('event', 'document', 'seconds'))
+        self.logger.log(self.level, '%s %s %s %s', record['event'], record['document'], stages, counts)
+
+
+class JsonLinesSink:
+    """ A sink that appends each record as a line of JSON to a file """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self, record):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, default=str) + '\n')
@@ -6,19 +6,19 @@ def main():
     analyzer = GovSnatch()
     analyzer.load_stop_words('stopwords.txt')
     
-    # Load conservative articles
-    analyzer.load_text('foxnews_conservative.txt', label='Fox News (Conservative)')
-    analyzer.load_text('nationalreview_conservative.txt', label='National Review (Conservative)')
-    analyzer.load_text('boundless_conservative.txt', label='Boundless (Conservative)')
-    analyzer.load_text('washingtonpost_conservative.txt', label='Washington Post (Conservative)')
-    analyzer.load_text('usnews_conservative.txt', label='US News (Conservative)')
-    
-    # Load liberal articles
-    analyzer.load_text('newyorktimes_libral.txt', label='New York Times (Liberal)')
-    analyzer.load_text('cityandstateny_libral.txt', label='City and State NY (Liberal)')
-    analyzer.load_text('forbes_libral.txt', label='Forbes (Liberal)')
-    analyzer.load_text('usatoday_libral.txt', label='USA Today (Liberal)')
-    analyzer.load_text('msnbc_libral.txt', label='MSNBC (Liberal)')
+    # Load conservative and liberal articles, parsed in parallel
+    analyzer.load_texts({
+        'foxnews_conservative.txt': 'Fox News (Conservative)',
+        'nationalreview_conservative.txt': 'National Review (Conservative)',
+        'boundless_conservative.txt': 'Boundless (Conservative)',
+        'washingtonpost_conservative.txt': 'Washington Post (Conservative)',
+        'usnews_conservative.txt': 'US News (Conservative)',
+        'newyorktimes_libral.txt': 'New York Times (Liberal)',
+        'cityandstateny_libral.txt': 'City and State NY (Liberal)',
+        'forbes_libral.txt': 'Forbes (Liberal)',
+        'usatoday_libral.txt': 'USA Today (Liberal)',
+        'msnbc_libral.txt': 'MSNBC (Liberal)',
+    })
     
     # # Create Sankey diagram 
     analyzer.wordcount_sankey(k=3)  # Show top 8 words from each source
@@ -8,55 +8,205 @@ with any arbitrary collection of related documents.
 """
 
 
-from collections import Counter, defaultdict
-import re 
+from collections import Counter, defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import asyncio
+import functools
+import mmap
+import os
+import types
 import matplotlib.pyplot as plt
 import numpy as np
 import plotly.graph_objects as go
 import textblob as tb
 
+from corpus_stats import CorpusStats, TermIndex
+from instrumentation import Profile
+from sentiment import Deferred, LexiconSentiment, SentenceSentiment
+from sketches import HeavyHitters
+import snapshot
+from tokenizer import Tokenizer
+
+
+# Bump whenever the output of the built-in parsers changes, so that
+# results saved in a ParseCache by an older version are not reused
+PARSER_VERSION = 4
+
+# Metrics produced by the built-in text parsers
+TEXT_METRICS = ('wordcount', 'numwords', 'bigramcount', 'trigramcount', 'avg polarity',
+                'avg subjectivity', 'avg sentence length', 'readability score', 'sentiment')
+
+# A parser registered with GovSnatch.register_parser
+ParserSpec = namedtuple('ParserSpec', ['name', 'parser', 'metrics'])
+
+
+class _Metrics(dict):
+    """ The values of one metric by document label. Deferred values are
+    computed when first read and then replaced by the result """
+
+    def __getitem__(self, label):
+        value = super().__getitem__(label)
+        if isinstance(value, Deferred):
+            value = value.resolve()
+            super().__setitem__(label, value)
+        return value
+
+    def get(self, label, default=None):
+        return self[label] if label in self else default
+
+    def values(self):
+        return [self[label] for label in self]
+
+    def items(self):
+        return [(label, self[label]) for label in self]
+
 
 class GovSnatch:
 
-    def __init__(self):
-        """ Contructor """
-        self.data = defaultdict(dict)
-        self.stop_words = set()
+    def __init__(self, cache=None, sentiment=None, store=None, ngram_sketch=None, sink=None,
+                 trace_memory=False):
+        """ Contructor
+
+        Parameters:
+        - cache: Optional ParseCache used to skip parsing unchanged documents
+        - sentiment: Sentiment engine with a score(sentences) method
+          (default: LexiconSentiment)
+        - store: Optional SparseCorpusStore backing the n-gram counts
+        - ngram_sketch: Optional dict of HeavyHitters parameters (epsilon, delta,
+          capacity). When given, bigrams and trigrams are counted approximately
+          in bounded memory instead of with exact Counters, with each sketch
+          made no wider than its document needs
+        - sink: Optional callable receiving a profiling record (a dict, see
+          instrumentation.py) for every parsed document. Silent by default.
+          Records hold timings and counts only, unless trace_memory is set
+        - trace_memory: Whether parses trace their memory with tracemalloc,
+          adding 'peak traced kb' to the records. Off by default, since
+          tracing makes parsing several times slower
+        """
+        self.data = defaultdict(_Metrics)
+        self.stop_words = set()  # also builds self.tokenizer
+        self.cache = cache
+        self.sentiment = sentiment if sentiment is not None else LexiconSentiment()
+        self.store = store
+        self.ngram_sketch = ngram_sketch
+        self.sink = sink
+        self.trace_memory = trace_memory
+        self._stats = CorpusStats()
+        self._index = TermIndex()  # per-document word rankings, unless a store holds them
+        self._unindexed = []  # loaded documents not yet added to the two above
+        self._loaded_totals = None  # their summed counts, by kind, from the snapshot
+        self.parsers = {}
+        self.extensions = {}
+        self.metrics = {}  # label -> metrics its parser produces
+        self.register_parser('text', self.simple_text_parser, extensions=('.txt',), metrics=TEXT_METRICS)
+        self.register_parser('stream', self.stream_text_parser, metrics=TEXT_METRICS)
+        self.register_parser('mmap', self.mmap_text_parser, metrics=TEXT_METRICS)
+        if store is not None:
+            # the counts are kept in sparse matrices behind dict-like views
+            for kind in store.KINDS:
+                self.data[kind] = store.view(kind)
 
     def load_stop_words(self, stopfile):
         '''Registers words in a provided stopfiles to ignore for future use'''
         with open(stopfile, 'r') as f:
             self.stop_words = set(word.strip().lower() for word in f.readlines())
 
+    @property
+    def stop_words(self):
+        return self._stop_words
+
+    @stop_words.setter
+    def stop_words(self, words):
+        """ Changing the stop list starts a new tokenizer, since every
+        vocabulary entry is classified against the stop list only once """
+        self._stop_words = words
+        self.tokenizer = Tokenizer(words)
+
+    def _emit(self, record):
+        """ Pass a profiling record to the sink, if there is one """
+        if self.sink is not None:
+            self.sink(record)
+
+    def _report_sentiment(self, label):
+        """ A SentenceSentiment listener reporting when a document is scored lazily """
+        def listener(seconds, sentences):
+            self._emit({'event': 'sentiment', 'document': label, 'seconds': {'sentiment': seconds},
+                        'sentences': sentences})
+        return listener
+
+    def _scored(self, results, name=None):
+        """ results with any lazy sentiment scored now and its Deferred averages
+        replaced by their values. Used before results leave this process, for
+        load_texts or a ParseCache, so the document text does not travel with
+        them and is not scored again on every cache hit """
+        sentiment = results.get('sentiment')
+        if isinstance(sentiment, SentenceSentiment) and not sentiment.evaluated:
+            if self.sink is not None:
+                sentiment.listener = self._report_sentiment(name)
+            sentiment.evaluate()
+            sentiment.listener = None
+        return {metric: value.resolve() if isinstance(value, Deferred) else value
+                for metric, value in results.items()}
+
+    def _ngram_counter(self, items=None):
+        """ A new, empty counter for bigrams or trigrams. items is the number
+        of n-grams it will count, if known, so a sketch can be sized to fit """
+        if self.ngram_sketch is not None:
+            return HeavyHitters(**{'items': items, **self.ngram_sketch})
+        return Counter()
+
+    def _count_ngrams(self, ids, n, counter=None):
+        """ Add the bigrams or trigrams of ids to counter, by default a new one
+        for a whole document, and return it. A sketch is fed in batches, so
+        the exact counts are never all held at once """
+        if counter is None:
+            if self.ngram_sketch is None:
+                return self.tokenizer.ngram_counts(ids, n)
+            counter = self._ngram_counter(max(len(ids) - n + 1, 1))
+        if isinstance(counter, HeavyHitters):
+            for batch in self.tokenizer.ngram_batches(ids, n):
+                counter.update_batch(*batch)
+        else:
+            counter.update(self.tokenizer.ngram_counts(ids, n))
+        return counter
+
     def simple_text_parser(self, filename):
-        """ For processing simple, unformatted text documents """
+        """ For processing simple, unformatted text documents. The text is
+        not kept for the lazily scored sentiment, which reads the file again
+        when it is first needed """
 
-        with open(filename, 'r', encoding='utf-8') as f:
-            text = f.read()
-
-        words = re.findall(r'\b\w+\b', text.lower())
-        filtered_words = [word for word in words if word not in self.stop_words]
-        wordcount = Counter(filtered_words)
-        numwords = len(filtered_words)
-
-        blob = tb.TextBlob(text)
-        sentences = blob.sentences
-        polarity = [sentence.sentiment.polarity for sentence in sentences]
-        subjectivity = [sentence.sentiment.subjectivity for sentence in sentences]
-        avg_polarity = sum(polarity) / len(polarity)
-        avg_subjectivity = sum(subjectivity) / len(subjectivity)
-        avg_sent_len = sum(len(sentence.words) for sentence in sentences) / len(sentences)
+        profile = Profile('parse', filename, trace=self.trace_memory, parser='simple_text_parser')
+        with profile.stage('read'):
+            with open(filename, 'r', encoding='utf-8') as f:
+                text = f.read()
+
+        return self.parse_text(text, filename, profile, source=filename)
+
+    def parse_text(self, text, name=None, profile=None, source=None):
+        """ The work of simple_text_parser on text already read into memory.
+        name identifies the document in profiling records. Sentiment is only
+        scored when first needed, and until then the results hold on to
+        text, unless source names the file to read it back from """
+        if profile is None:
+            profile = Profile('parse', name, trace=self.trace_memory, parser='parse_text')
+        with profile.stage('tokenize'):
+            ids = self.tokenizer.tokenize(text)
+        with profile.stage('ngrams'):
+            wordcount = self.tokenizer.ngram_counts(ids, 1)
+        numwords = wordcount.total()
+
+        # sentence splitting and scoring only happen once a sentiment metric is
+        # read, or when the results are cached or sent back from a worker
+        sentiment = SentenceSentiment(None if source is not None else text, self.sentiment, source)
         #implement a readability score by looking at the average length of words.
 
-        total_characters = sum(len(word) for word in filtered_words)
+        total_characters = self.tokenizer.num_characters(ids[~self.tokenizer.stop_mask(ids)])
         avg_word_len = total_characters / numwords if numwords > 0 else 0
 
         #track bigrams and trigrams
-        bigrams = [(w1, w2) for w1, w2 in zip(words, words[1:]) if w1 not in self.stop_words and w2 not in self.stop_words]
-        bigramcount = Counter(bigrams)
-
-        trigrams = [(w1, w2, w3) for w1, w2, w3 in zip(words, words[1:], words[2:]) if w1 not in self.stop_words and w2 not in self.stop_words and w3 not in self.stop_words]
-        trigramcount = Counter(trigrams)
+        with profile.stage('ngrams'):
+            bigramcount = self._count_ngrams(ids, 2)
+            trigramcount = self._count_ngrams(ids, 3)
 
         #store in results dictionary
         results = {
@@ -64,29 +214,606 @@ class GovSnatch:
             'numwords': numwords,
             'bigramcount': bigramcount,
             'trigramcount': trigramcount,
-            'avg polarity': avg_polarity,
-            'avg subjectivity': avg_subjectivity,
-            'avg sentence length': avg_sent_len,
-            'readability score': avg_word_len
+            'avg polarity': sentiment.deferred('avg polarity'),
+            'avg subjectivity': sentiment.deferred('avg subjectivity'),
+            'avg sentence length': sentiment.deferred('avg sentence length'),
+            'readability score': avg_word_len,
+            'sentiment': sentiment
         }
 
-        print("Parsed:", filename, ":", results)
+        self._emit(profile.finish(characters=len(text), tokens=len(ids), vocabulary=len(wordcount),
+                                  **{'total vocabulary': len(self.tokenizer.words)}))
         return results
 
+    @staticmethod
+    def read_segments(filename, chunk_size=1 << 20):
+        """ Yield the text of a file in pieces of roughly chunk_size characters.
+        Each piece ends on a line break (or whitespace if a chunk has no line
+        break) so that no word or paragraph is split across two pieces. A file
+        that fits in one chunk comes back whole """
+        with open(filename, 'r', encoding='utf-8') as f:
+            chunk = f.read(chunk_size)
+            while chunk:
+                following = f.read(chunk_size)
+                if not following:
+                    # nothing left to carry the tail over to
+                    yield chunk
+                    break
+                cut = chunk.rfind('\n') + 1
+                if cut == 0:
+                    # no line break in this chunk, fall back to the last whitespace
+                    cut = max(chunk.rfind(' '), chunk.rfind('\t')) + 1
+                if cut > 0:
+                    yield chunk[:cut]
+                chunk = chunk[cut:] + following
+
+    def stream_text_parser(self, filename, chunk_size=1 << 20):
+        """ For processing simple text documents too large to hold in memory.
+        Reads the file in chunks and updates the word, bigram and trigram
+        counters in a single pass, so peak memory is bounded by the chunk size
+        and the vocabulary rather than the document size.
+
+        Sentiment is scored per chunk, and chunks always end on a line break,
+        so averages match simple_text_parser as long as no sentence is wrapped
+        over several lines. Unlike simple_text_parser it is scored right away,
+        since putting it off would mean keeping the whole text. """
+        wordcount = Counter()
+        bigramcount = self._ngram_counter()
+        trigramcount = self._ngram_counter()
+        numwords = 0
+        total_characters = 0
+        total_polarity = 0.0
+        total_subjectivity = 0.0
+        numsentences = 0
+        sentence_words = 0
+        # per-sentence values, kept as compact arrays per chunk
+        series = []
+
+        profile = Profile('parse', filename, trace=self.trace_memory, parser='stream_text_parser')
+        characters = 0
+        tokens = 0
+
+        # last two word ids of the previous chunk, so n-grams can span chunks
+        prev = np.zeros(0, dtype=np.int32)
+        segments = self.read_segments(filename, chunk_size)
+        while True:
+            with profile.stage('read'):
+                segment = next(segments, None)
+            if segment is None:
+                break
+            characters += len(segment)
+
+            with profile.stage('tokenize'):
+                ids = self.tokenizer.tokenize(segment)
+            tokens += len(ids)
+            with profile.stage('ngrams'):
+                words = self.tokenizer.ngram_counts(ids, 1)
+                wordcount.update(words)
+                numwords += words.total()
+                total_characters += self.tokenizer.num_characters(ids[~self.tokenizer.stop_mask(ids)])
+
+                # only count the n-grams that end inside this chunk
+                window = np.concatenate([prev, ids])
+                self._count_ngrams(window[max(len(prev) - 1, 0):], 2, bigramcount)
+                self._count_ngrams(window[max(len(prev) - 2, 0):], 3, trigramcount)
+                prev = window[-2:]
+
+            with profile.stage('sentiment'):
+                sentences = tb.TextBlob(segment).sentences
+                polarity, subjectivity = self.sentiment.score([sentence.raw for sentence in sentences])
+            total_polarity += sum(polarity)
+            total_subjectivity += sum(subjectivity)
+            words_per_sentence = [len(sentence.words) for sentence in sentences]
+            sentence_words += sum(words_per_sentence)
+            numsentences += len(sentences)
+            series.append((np.asarray(polarity, dtype=np.float32), np.asarray(subjectivity, dtype=np.float32),
+                           np.asarray(words_per_sentence, dtype=np.int32)))
+
+        results = {
+            'wordcount': wordcount,
+            'numwords': numwords,
+            'bigramcount': bigramcount,
+            'trigramcount': trigramcount,
+            'avg polarity': total_polarity / numsentences if numsentences > 0 else 0,
+            'avg subjectivity': total_subjectivity / numsentences if numsentences > 0 else 0,
+            'avg sentence length': sentence_words / numsentences if numsentences > 0 else 0,
+            'readability score': total_characters / numwords if numwords > 0 else 0
+        }
+        columns = [np.concatenate(column) for column in zip(*series)] if series else [(), (), ()]
+        averages = {name: results[name] for name in SentenceSentiment.AVERAGES}
+        results['sentiment'] = SentenceSentiment.from_scores(*columns, averages=averages)
+
+        self._emit(profile.finish(characters=characters, tokens=tokens, vocabulary=len(wordcount),
+                                  sentences=numsentences, **{'total vocabulary': len(self.tokenizer.words)}))
+        return results
+
+    @staticmethod
+    def mapped_segments(buffer, segment_size=1 << 22):
+        """ Yield the UTF-8 bytes of buffer decoded in pieces of roughly
+        segment_size bytes. Pieces end after a blank line where possible, or
+        else a line break, so sentences are rarely split between two pieces """
+        start = 0
+        while start < len(buffer):
+            end = start + segment_size
+            if end < len(buffer):
+                cut = buffer.rfind(b'\n\n', start, end)
+                if cut < 0:
+                    cut = buffer.rfind(b'\n', start, end)
+                if cut < 0:
+                    # no line break in range, read on to the next one
+                    cut = buffer.find(b'\n', end)
+                end = cut + 1 if cut >= 0 else len(buffer)
+            yield buffer[start:end].decode('utf-8')
+            start = end
+
+    def mmap_text_parser(self, filename, segment_size=1 << 22):
+        """ For processing large simple text documents without copying them
+        into a string. The file is memory mapped and tokenized as bytes, so
+        only distinct words are decoded. Sentiment is scored on decoded pieces
+        of at most about segment_size bytes (see mapped_segments), right away
+        rather than lazily, as the pieces are not kept; documents smaller than
+        that give exactly the results of simple_text_parser """
+        profile = Profile('parse', filename, trace=self.trace_memory, parser='mmap_text_parser')
+        with profile.stage('read'):
+            with open(filename, 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    # an empty file cannot be mapped
+                    buffer = b''
+                else:
+                    buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        size = len(buffer)
+
+        try:
+            # pages are read in as the tokenizer touches them
+            with profile.stage('tokenize'):
+                ids = self.tokenizer.tokenize_bytes(buffer)
+            polarity = []
+            subjectivity = []
+            sentence_words = []
+            with profile.stage('sentiment'):
+                for segment in self.mapped_segments(buffer, segment_size):
+                    sentences = tb.TextBlob(segment).sentences
+                    scores = self.sentiment.score([sentence.raw for sentence in sentences])
+                    polarity.extend(scores[0])
+                    subjectivity.extend(scores[1])
+                    sentence_words.extend(len(sentence.words) for sentence in sentences)
+        finally:
+            if isinstance(buffer, mmap.mmap):
+                buffer.close()
+        sentiment = SentenceSentiment.from_scores(polarity, subjectivity, sentence_words)
+
+        with profile.stage('ngrams'):
+            wordcount = self.tokenizer.ngram_counts(ids, 1)
+            numwords = wordcount.total()
+            total_characters = self.tokenizer.num_characters(ids[~self.tokenizer.stop_mask(ids)])
+
+            bigramcount = self._count_ngrams(ids, 2)
+            trigramcount = self._count_ngrams(ids, 3)
+
+        results = {
+            'wordcount': wordcount,
+            'numwords': numwords,
+            'bigramcount': bigramcount,
+            'trigramcount': trigramcount,
+            'avg polarity': sentiment.average('avg polarity'),
+            'avg subjectivity': sentiment.average('avg subjectivity'),
+            'avg sentence length': sentiment.average('avg sentence length'),
+            'readability score': total_characters / numwords if numwords > 0 else 0,
+            'sentiment': sentiment
+        }
+
+        self._emit(profile.finish(bytes=size, tokens=len(ids), vocabulary=len(wordcount),
+                                  sentences=len(polarity), **{'total vocabulary': len(self.tokenizer.words)}))
+        return results
+
+    def register_parser(self, name, parser, extensions=(), metrics=None):
+        """ Make a parser available to load_text by name and by file extension.
+
+        Parameters:
+        - name: Name to select the parser with, e.g. load_text(f, parser='json')
+        - parser: Callable taking a filename and returning a dict of metrics
+        - extensions: File extensions (like '.json') parsed by default with it
+        - metrics: Names of the metrics the parser produces, so visualizations
+          can skip the ones it does not. Defaults to the parser's own
+          `metrics` attribute, or whatever its results contain
+        """
+        if metrics is None:
+            metrics = getattr(parser, 'metrics', None)
+        self.parsers[name] = ParserSpec(name, parser, None if metrics is None else tuple(metrics))
+        for extension in extensions:
+            self.extensions[extension.lower()] = name
+
+    def resolve_parser(self, filename, parser=None):
+        """ Pick the ParserSpec for a file: a registered name, a callable,
+        or by default the parser registered for its extension ('text'
+        for unknown extensions) """
+        if parser is None:
+            extension = os.path.splitext(filename)[1].lower()
+            parser = self.extensions.get(extension, 'text')
+        if isinstance(parser, str):
+            if parser not in self.parsers:
+                raise ValueError(f'Unknown parser: {parser}')
+            return self.parsers[parser]
+        return ParserSpec(None, parser, getattr(parser, 'metrics', None))
+
     def load_text(self, filename, label=None, parser=None):
         """ Register a document with the framework and
         store data extracted from the document to be used
-        later in visualizations """
+        later in visualizations. Only the selected parser runs.
+        simple_text_parser scores sentiment when it is first read, from
+        the file rather than a copy of its text kept in memory """
+        spec = self.resolve_parser(filename, parser)
+        key, results = self._cached(filename, spec.parser)
+        if results is None:
+            results = spec.parser(filename)
+            if key is not None:
+                results = self._scored(results, filename)
+                self.cache.put(key, results)
+
+        self._store(filename, label, results, spec)
+
+    def load_texts(self, mapping, parser=None, workers=None):
+        """ Register many documents at once, parsing them in a process pool.
+
+        Parameters:
+        - mapping: dict of filename -> label (a label of None uses the filename)
+        - parser: Optional parser name or callable applied to every file (a
+          callable must be picklable); by default chosen by file extension
+        - workers: Number of worker processes (default: os.cpu_count()),
+          1 parses sequentially in this process. Each worker parses with its
+          own instance of this class, so subclasses' parsers are used there
+          too; their constructors must accept GovSnatch's keywords
+
+        Results are merged in the order of mapping, so self.data ends up
+        identical to calling load_text on each file in turn.
+        """
+        items = list(mapping.items())
+        specs = [self.resolve_parser(filename, parser) for filename, _ in items]
+        cached = [self._cached(filename, spec.parser) for (filename, _), spec in zip(items, specs)]
+        missing = [(filename, spec.parser) for (filename, _), spec, (_, results)
+                   in zip(items, specs, cached) if results is None]
+        parsed = iter(self._parse_many(missing, workers))
 
-        results = self.simple_text_parser(filename) # default
-        if parser is not None:
-            results = parser(filename)
+        for (filename, label), spec, (key, results) in zip(items, specs, cached):
+            if results is None:
+                results = next(parsed)
+                if key is not None:
+                    results = self._scored(results, filename)
+                    self.cache.put(key, results)
+            self._store(filename, label, results, spec)
 
+    async def aload_texts(self, mapping, parser=None, workers=None, readers=8, queue_size=None,
+                          timeout=None, reader=None):
+        """ Register many documents at once, overlapping slow file reads with
+        parsing. Reader threads feed a bounded queue that a pool of worker
+        processes drains; when parsing falls behind the queue fills up and
+        reading pauses, so at most queue_size documents wait in memory.
+
+        Parameters:
+        - mapping: dict of filename -> label (a label of None uses the filename)
+        - parser: Optional parser name or callable, as for load_texts
+        - workers: Number of worker processes (default: os.cpu_count()),
+          1 parses in a thread of this process
+        - readers: Number of files read at the same time
+        - queue_size: Documents read but not yet parsed (default: 2 * workers)
+        - timeout: Optional seconds allowed for reading a document, and again
+          for parsing it
+        - reader: Optional function filename -> bytes (plain or async) used to
+          read documents, e.g. to fetch them from elsewhere. Only documents
+          parsed by simple_text_parser are read this way (unless a subclass
+          overrides it); other parsers open their files themselves in the worker
+
+        Returns:
+        - dict of filename -> exception for documents that failed to read or
+          timed out. They are left out; every other document is stored in the
+          order of mapping, so self.data matches load_texts
+
+        A parse that times out is abandoned, but its worker process still
+        finishes it before taking new work.
+        """
+        items = list(mapping.items())
+        specs = [self.resolve_parser(filename, parser) for filename, _ in items]
+        if workers is None:
+            workers = os.cpu_count() or 1
+        workers = max(1, min(workers, len(items)))
+        if queue_size is None:
+            queue_size = 2 * workers
+        if reader is None:
+            reader = _read_bytes
+
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=queue_size)
+        pending = iter(range(len(items)))  # shared by the reader tasks
+        keys = [None] * len(items)
+        results = [None] * len(items)
+        failed = {}
+
+        if workers > 1:
+            # fail before reading anything if a parser cannot go to the workers
+            for spec in specs:
+                self._worker_parser(spec.parser)
+
+        io_pool = ThreadPoolExecutor(max_workers=readers)
+        if workers == 1:
+            cpu_pool = ThreadPoolExecutor(max_workers=1)
+        else:
+            cpu_pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                           initargs=(type(self), self.stop_words, self._config(), self.sink is not None))
+
+        async def read(filename):
+            if asyncio.iscoroutinefunction(reader):
+                return await reader(filename)
+            return await loop.run_in_executor(io_pool, reader, filename)
+
+        async def produce():
+            for i in pending:
+                filename, spec = items[i][0], specs[i]
+                content = None
+                try:
+                    if self._reads_text(spec.parser):
+                        content = await asyncio.wait_for(read(filename), timeout)
+                        keys[i], results[i] = self._cached(filename, spec.parser, content)
+                    else:
+                        keys[i], results[i] = await asyncio.wait_for(
+                            loop.run_in_executor(io_pool, self._cached, filename, spec.parser), timeout)
+                except (OSError, asyncio.TimeoutError) as error:
+                    failed[filename] = error
+                    continue
+                if results[i] is None:
+                    # waits here while the parsers are behind
+                    await queue.put((i, content))
+
+        def task(filename, spec, content):
+            if workers == 1:
+                if content is not None:
+                    return self.parse_text, _decode_text(content), filename
+                return spec.parser, filename
+            if content is not None:
+                return _parse_document_text, content, filename
+            return _parse_document, filename, self._worker_parser(spec.parser)
+
+        async def consume():
+            while True:
+                job = await queue.get()
+                if job is None:
+                    return
+                i, content = job
+                filename = items[i][0]
+                try:
+                    results[i] = await asyncio.wait_for(
+                        loop.run_in_executor(cpu_pool, *task(filename, specs[i], content)), timeout)
+                except asyncio.TimeoutError as error:
+                    failed[filename] = error
+                    continue
+                if workers > 1:
+                    results[i], records = results[i]
+                    for record in records:
+                        self._emit(record)
+
+        async def read_all():
+            await asyncio.gather(*(produce() for _ in range(readers)))
+            for _ in range(workers):
+                await queue.put(None)
+
+        tasks = [asyncio.ensure_future(read_all())] + [asyncio.ensure_future(consume()) for _ in range(workers)]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for t in tasks:
+                t.cancel()
+            raise
+        finally:
+            # a read stuck on a dead mount cannot be interrupted, so don't wait for it
+            io_pool.shutdown(wait=False, cancel_futures=True)
+            cpu_pool.shutdown(wait=not failed, cancel_futures=True)
+
+        for i, ((filename, label), spec) in enumerate(zip(items, specs)):
+            if filename in failed:
+                continue
+            if keys[i] is not None and results[i] is not None:
+                results[i] = self._scored(results[i], filename)
+                self.cache.put(keys[i], results[i])
+            self._store(filename, label, results[i], spec)
+        return failed
+
+    def _parse_many(self, jobs, workers=None):
+        """ Parse a list of (filename, parser) jobs in a process pool,
+        returning their results in the same order as jobs """
+        if workers is None:
+            workers = os.cpu_count() or 1
+        workers = min(workers, len(jobs))
+
+        if workers <= 1:
+            return [parser(filename) for filename, parser in jobs]
+
+        filenames = [filename for filename, _ in jobs]
+        parsers = [self._worker_parser(parser) for _, parser in jobs]
+
+        chunksize = max(1, len(jobs) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(type(self), self.stop_words, self._config(), self.sink is not None)) as pool:
+            parsed = list(pool.map(_parse_document, filenames, parsers, chunksize=chunksize))
+        # pass on the profiling records the workers collected
+        for _, records in parsed:
+            for record in records:
+                self._emit(record)
+        return [results for results, _ in parsed]
+
+    def _worker_parser(self, parser):
+        """ How a worker process finds parser. Methods of this instance are
+        looked up by name on the worker's own instance of the same class,
+        rather than pickling self.data into every task; anything else is
+        pickled as is. Raises ValueError for a method the worker cannot look
+        up, e.g. one attached to this instance only """
+        if getattr(parser, '__self__', None) is not self:
+            return parser
+        name = parser.__name__
+        if getattr(type(self), name, None) is not parser.__func__:
+            raise ValueError(f'Parser {name!r} is not a method of {type(self).__name__}, so worker '
+                             'processes cannot rebuild it; use workers=1')
+        return name
+
+    def _reads_text(self, parser):
+        """ Whether parser is the built-in simple_text_parser, which only
+        needs the file's text and can be given it already read """
+        return parser == self.simple_text_parser and \
+            type(self).simple_text_parser is GovSnatch.simple_text_parser
+
+    def _parser_id(self, parser):
+        """ A stable name for a parser and the settings it parses with, used
+        as part of its cache key. None when the parser has no stable name
+        (see _callable_id), and its results are not cached """
+        name = _callable_id(parser)
+        if name is None:
+            return None
+        engine = type(self.sentiment).__qualname__
+        sketch = sorted(self.ngram_sketch.items()) if self.ngram_sketch is not None else None
+        return f'{name}:{engine}:{sketch}:{PARSER_VERSION}'
+
+    def _config(self):
+        """ The constructor arguments that affect parsing, for worker processes """
+        return {'sentiment': self.sentiment, 'ngram_sketch': self.ngram_sketch,
+                'trace_memory': self.trace_memory}
+
+    def _cached(self, filename, parser, content=None):
+        """ Look a document up in the parse cache. Returns (key, results),
+        where results is None on a miss and both are None without a cache.
+        content is the file's bytes when they have already been read """
+        parser_id = self._parser_id(parser) if self.cache is not None else None
+        if parser_id is None:
+            return None, None
+        key = self.cache.key(filename, self.stop_words, parser_id, content)
+        return key, self.cache.get(key)
+
+    def _store(self, filename, label, results, spec):
+        """ Save the results of parsing a document under its label """
         if label is None:
             label = filename
 
+        self.add_document(label, results, spec.metrics)
+
+    @property
+    def stats(self):
+        """ Running corpus totals (CorpusStats) """
+        self._count_loaded()
+        return self._stats
+
+    @property
+    def index(self):
+        """ Per-document word rankings and inverted index (TermIndex) """
+        self._index_loaded()
+        return self._index
+
+    def _count_loaded(self):
+        """ Add the documents restored by load to the corpus totals. Each
+        kind is read from the snapshot only when it is first queried """
+        totals, self._loaded_totals = self._loaded_totals, None
+        if totals is not None:
+            for kind in CorpusStats.KINDS:
+                self._stats.add_totals(kind, functools.partial(totals, kind))
+
+    def _index_loaded(self):
+        """ Add the documents restored by load to the word index, which is
+        put off until it is first needed """
+        pending, self._unindexed = self._unindexed, []
+        wordcounts = self.data.get('wordcount', {})
+        if self.store is None:
+            for label in pending:
+                if label in wordcounts:
+                    self._index.add(label, wordcounts[label])
+
+    def save(self, path):
+        """ Write every document to a snapshot directory (see snapshot.py)
+        that GovSnatch.load can memory map back. Much smaller and faster to
+        load than pickling self.data """
+        snapshot.save(self, path)
+
+    @classmethod
+    def load(cls, path):
+        """ Restore an instance saved with save. Counts and sentiment series
+        stay memory mapped; corpus totals are read from the snapshot one kind
+        at a time, and the word index is rebuilt, on first use """
+        settings, documents, totals = snapshot.load(path)
+        analyzer = cls(ngram_sketch=settings['ngram_sketch'])
+        analyzer.stop_words = set(settings['stop_words'])
+        for label, results, metrics in documents:
+            for k, v in results.items():
+                analyzer.data[k][label] = v
+            analyzer.metrics[label] = tuple(metrics)
+            analyzer._unindexed.append(label)
+        analyzer._loaded_totals = totals
+        return analyzer
+
+    def has_metric(self, label, metric):
+        """ Whether the parser of a document produces a metric """
+        return metric in self.metrics.get(label, ())
+
+    def add_document(self, label, results, metrics=None):
+        """ Register the parse results of a document under label, replacing
+        any document already stored under that label. Corpus-wide totals
+        are updated in time proportional to the document, not the corpus.
+        metrics lists what the parser declared it produces (default: the
+        keys of results) """
+        if self.has_document(label):
+            self.remove_document(label)
+
         for k, v in results.items():
             self.data[k][label] = v
+        self.metrics[label] = tuple(results) if metrics is None else tuple(metrics)
+        self.stats.add(results)
+        sentiment = results.get('sentiment')
+        if self.sink is not None and isinstance(sentiment, SentenceSentiment) and not sentiment.evaluated:
+            sentiment.listener = self._report_sentiment(label)
+        if self.store is None and 'wordcount' in results:
+            self.index.add(label, results['wordcount'])
+
+    def remove_document(self, label):
+        """ Remove a document from the framework and return its results """
+        results = {k: values.pop(label) for k, values in self.data.items() if label in values}
+        if not results:
+            raise KeyError(label)
+        self.metrics.pop(label, None)
+        self.stats.remove(results)
+        if label in self.index:
+            self.index.remove(label)
+        return results
+
+    def has_document(self, label):
+        """ Whether a document is registered under label """
+        return any(label in values for values in self.data.values())
+
+    def document(self, label):
+        """ The parse results stored for one document. Counts held in a
+        sparse store are copied out into plain Counters """
+        results = {}
+        for k, values in self.data.items():
+            if label in values:
+                value = values[label]
+                results[k] = value.to_counter() if hasattr(value, 'to_counter') else value
+        return results
+
+    def subset(self, labels):
+        """ A new GovSnatch holding only the given documents, in that order """
+        other = GovSnatch(sentiment=self.sentiment, ngram_sketch=self.ngram_sketch)
+        other.stop_words = self.stop_words
+        for label in labels:
+            other.add_document(label, self.document(label), self.metrics.get(label))
+        return other
+
+    def rolling_sentiment(self, label, window=10, metric='polarity'):
+        """ Rolling mean of a per-sentence sentiment metric of one document.
+
+        Parameters:
+        - label: The document
+        - window: Number of consecutive sentences averaged
+        - metric: 'polarity', 'subjectivity' or 'sentence words'
+
+        Returns:
+        - float32 array with one value per full window
+        """
+        if not self.has_metric(label, 'sentiment'):
+            raise KeyError(f'No per-sentence sentiment for {label!r}')
+        return self.data['sentiment'][label].rolling(window, metric)
 
     def compare_num_words(self, metric):
         """ A very simplistic visualization that creats a bar
@@ -101,16 +828,17 @@ class GovSnatch:
         # plt.show()
         print(dict.keys())
 
-    def wordcount_sankey(self, word_list=None, k=5):
+    def wordcount_sankey(self, word_list=None, k=5, show=True):
         """
         Create a Sankey diagram showing the relationship between text sources and words.
         
         Parameters:
         - word_list: Optional list of specific words to include
         - k: If word_list is None, include the top k words from each document
+        - show: Whether to display the diagram
         
         Returns:
-        - Displays a Sankey diagram
+        - The plotly Sankey figure
         """
         # Get wordcount data
         wordcount_data = self.data['wordcount']
@@ -121,11 +849,13 @@ class GovSnatch:
         # If no specific words provided, get top k words from each document
         if word_list is None:
             # Get top k words from each document
-            all_top_words = set()
-            for doc, counter in wordcount_data.items():
-                top_words = [word for word, _ in counter.most_common(k)]
-                all_top_words.update(top_words)
-            word_list = list(all_top_words)
+            if self.store is not None:
+                # ranked on demand from each document's sparse row
+                top_words = (self.store.top_k('wordcount', k, doc) for doc in doc_labels)
+            else:
+                # read off the rankings the index made when the documents were added
+                top_words = (self.index.top_k(doc, k) for doc in doc_labels)
+            word_list = list(dict.fromkeys(word for top in top_words for word, _ in top))
         
         # Create sources, targets, and values for Sankey diagram
         sources = []
@@ -137,14 +867,20 @@ class GovSnatch:
         word_indices = {word: i + len(doc_labels) for i, word in enumerate(word_list)}
         
         # Create the links
-        for doc, counter in wordcount_data.items():
-            doc_idx = doc_indices[doc]
-            for word in word_list:
-                if word in counter and counter[word] > 0:
-                    word_idx = word_indices[word]
-                    sources.append(doc_idx)
-                    targets.append(word_idx)
-                    values.append(counter[word])
+        if self.store is not None:
+            table, labels = self.store.frequencies('wordcount', word_list)
+            rows, cols = np.nonzero(table)
+            sources = [doc_indices[labels[row]] for row in rows]
+            targets = [word_indices[word_list[col]] for col in cols]
+            values = table[rows, cols].tolist()
+        else:
+            # only the documents that contain each word, from the inverted index
+            links = sorted((doc_indices[doc], word_indices[word], count)
+                           for word in word_list for doc, count in self.index.documents(word).items())
+            for doc_idx, word_idx, count in links:
+                sources.append(doc_idx)
+                targets.append(word_idx)
+                values.append(count)
         
         # Create labels for the nodes
         node_labels = doc_labels + word_list
@@ -208,20 +944,35 @@ class GovSnatch:
             height=800
         )
             
-        fig.show()   
+        if show:
+            fig.show()
+        return fig
 
-    def bigram_visualization(self, top_n=8, figsize=(15, 10)):
+    def bigram_visualization(self, top_n=8, figsize=(15, 10), show=True):
         """
         Create a grid of subplots, each showing the top N bigrams for a document.
 
         Parameters:
         - top_n: Number of top bigrams to display per document (default: 8)
         - figsize: Tuple for figure size (width, height)
+        - show: Whether to display the figure
+
+        Returns:
+        - The matplotlib figure
         """
         # Get bigram data
         bigram_data = self.data['bigramcount']
         doc_labels = list(bigram_data.keys())
         num_docs = len(doc_labels)
+        if num_docs == 0:
+            # none of the parsers used produce bigrams: an empty figure saying so
+            fig, ax = plt.subplots(figsize=figsize)
+            ax.axis('off')
+            ax.text(0.5, 0.5, 'No documents with bigram counts', ha='center', va='center', fontsize=14)
+            fig.suptitle(f'Top {top_n} Bigrams per Document', fontsize=16)
+            if show:
+                plt.show()
+            return fig
 
         rows = (num_docs + 1) // 2  
         cols = 2
@@ -252,9 +1003,11 @@ class GovSnatch:
 
 
         fig.suptitle(f'Top {top_n} Bigrams per Document', fontsize=16)
-        plt.show()
+        if show:
+            plt.show()
+        return fig
         
-    def compare_documents(self, k=15, words=None, figsize=(18, 10)):
+    def compare_documents(self, k=15, words=None, figsize=(18, 10), show=True):
         """
         Create a grouped bar chart comparing word usage across all documents,
         and a scatter plot comparing polarity and subjectivity across all documents.
@@ -263,6 +1016,10 @@ class GovSnatch:
         - k: Number of top words to compare if words=None (default: 15)
         - words: Optional list of specific words to analyze
         - figsize: Tuple for figure size (width, height)
+        - show: Whether to display the figure
+
+        Returns:
+        - The matplotlib figure
         """
         # Get wordcount data
         wordcount_data = self.data['wordcount']
@@ -270,18 +1027,20 @@ class GovSnatch:
 
         # Determine words to compare
         if words is None:
-            # Get top k words across all documents
-            all_words = Counter()
-            for counter in wordcount_data.values():
-                all_words.update(counter)
-            words = [word for word, _ in all_words.most_common(k) if word not in self.stop_words]
+            # Get top k words across all documents from the running totals
+            words = [word for word, _ in self.stats.top_k('wordcount', k) if word not in self.stop_words]
 
         # Prepare data for plotting
-        word_freqs = {word: [] for word in words}
-        for doc in doc_labels:
-            counter = wordcount_data[doc]
+        if self.store is not None:
+            table, _ = self.store.frequencies('wordcount', words)
+            word_freqs = {word: table[:, j].tolist() for j, word in enumerate(words)}
+        else:
+            rows = {doc: i for i, doc in enumerate(doc_labels)}
+            word_freqs = {}
             for word in words:
-                word_freqs[word].append(counter.get(word, 0))
+                word_freqs[word] = [0] * len(doc_labels)
+                for doc, count in self.index.documents(word).items():
+                    word_freqs[word][rows[doc]] = count
 
         # Set up plot
         fig, (ax1, ax2) = plt.subplots(2, 1, figsize=figsize)
@@ -297,9 +1056,11 @@ class GovSnatch:
             color = cmap(i % cmap.N)
             bar_position = [x + bar_width * i for x in index]
             ax1.bar(bar_position, frequencies, bar_width, label=doc, color=color)
-            polarities = self.data['avg polarity'][doc]
-            subjectivities = self.data['avg subjectivity'][doc]
-            ax2.scatter(polarities, subjectivities, color=color, label=doc)
+            # documents whose parser has no sentiment are left off the scatter plot
+            if self.has_metric(doc, 'avg polarity') and self.has_metric(doc, 'avg subjectivity'):
+                polarities = self.data['avg polarity'][doc]
+                subjectivities = self.data['avg subjectivity'][doc]
+                ax2.scatter(polarities, subjectivities, color=color, label=doc)
 
         
         ax1.set_xlabel('Words')
@@ -316,5 +1077,88 @@ class GovSnatch:
         ax2.set_title('Sentiment Analysis Across Documents')
 
         plt.tight_layout()
-        plt.show()
+        if show:
+            plt.show()
+        return fig
+
+
+
+def _callable_id(parser):
+    """ A name telling parser apart from every other parser, or None if it
+    has none that is stable across runs. A cache_id attribute is used if
+    the parser has one. Otherwise module-level functions and methods are
+    named by module and qualified name (methods by the class of their
+    instance), and functools.partial objects by their function, arguments
+    and keywords. Lambdas, nested functions and other callable objects
+    need a cache_id to be cached """
+    cache_id = getattr(parser, 'cache_id', None)
+    if cache_id is not None:
+        return str(cache_id)
+    if isinstance(parser, functools.partial):
+        func = _callable_id(parser.func)
+        if func is None:
+            return None
+        return f'partial({func}, {parser.args!r}, {sorted(parser.keywords.items())!r})'
+    owner = getattr(parser, '__self__', None)
+    if owner is not None and not isinstance(owner, types.ModuleType):
+        if '<' in getattr(parser, '__qualname__', '<'):
+            return None
+        cls = owner if isinstance(owner, type) else type(owner)
+        return f'{cls.__module__}.{cls.__qualname__}.{parser.__name__}'
+    name = getattr(parser, '__qualname__', None)
+    if not isinstance(parser, (types.FunctionType, types.BuiltinFunctionType)) or name is None \
+            or '<' in name:
+        return None
+    return f'{parser.__module__}.{name}'
+
+
+# Per-process analyzer used by load_texts workers, and the profiling
+# records of the document it is parsing
+_worker = None
+_records = []
+
+
+def _init_worker(cls, stop_words, config, profile=False):
+    """ Set up the analyzer of a load_texts worker process, an instance of
+    cls (GovSnatch or the subclass doing the loading, whose constructor must
+    accept the same keywords). With profile, its profiling records are
+    collected and sent back with the results """
+    global _worker
+    _worker = cls(**config, sink=_records.append if profile else None)
+    _worker.stop_words = stop_words
+
+
+def _parse_document(filename, parser):
+    """ Parse one document inside a load_texts worker process.
+    Returns (results, profiling records) """
+    if isinstance(parser, str):
+        results = getattr(_worker, parser)(filename)
+    else:
+        results = parser(filename)
+    return _worker._scored(results, filename), _take_records()
+
+
+def _parse_document_text(content, filename):
+    """ Parse a document already read by aload_texts inside a worker process """
+    results = _worker.parse_text(_decode_text(content), filename)
+    return _worker._scored(results, filename), _take_records()
+
+
+def _take_records():
+    records = _records[:]
+    _records.clear()
+    return records
+
+
+def _read_bytes(filename):
+    """ The default aload_texts reader """
+    with open(filename, 'rb') as f:
+        return f.read()
+
 
+def _decode_text(content):
+    """ The text simple_text_parser would have read from a file's bytes,
+    with line endings translated like open() in text mode """
+    if isinstance(content, str):
+        return content
+    return content.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
@@ -0,0 +1,121 @@
+"""
+File: parse_cache.py
+
+Description: A persistent, content-addressed cache for the
+results of GovSnatch parsers, so that unchanged documents are
+not re-tokenized and re-scored on every run.
+
+"""
+
+
+import hashlib
+import os
+import pickle
+import zlib
+
+
+class ParseCache:
+
+    def __init__(self, directory='.govsnatch_cache', max_bytes=256 * 1024 * 1024):
+        """ Constructor
+
+        Parameters:
+        - directory: Folder the cache entries are written to
+        - max_bytes: Total size the cache may grow to before the least
+          recently used entries are evicted
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # running total of the entry sizes, counted on the first put; other
+        # processes writing to the same folder are only seen at the next evict
+        self._size = None
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def file_hash(filename, block_size=1 << 20):
+        """ Hash the contents of a file without reading it into memory at once """
+        digest = hashlib.sha256()
+        with open(filename, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def stop_words_hash(stop_words):
+        """ Hash a stop word set independently of its iteration order """
+        return hashlib.sha256('\n'.join(sorted(stop_words)).encode('utf-8')).hexdigest()
+
+    def key(self, filename, stop_words, parser_id, content=None):
+        """ Build the cache key of a document. It changes whenever the file
+        content, the stop list or the parser changes. content, the bytes of
+        the file if already read, saves reading it a second time """
+        if content is None:
+            digest = self.file_hash(filename)
+        else:
+            digest = hashlib.sha256(content.encode('utf-8') if isinstance(content, str) else content).hexdigest()
+        parts = (digest, self.stop_words_hash(stop_words), parser_id)
+        return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.bin')
+
+    def get(self, key):
+        """ Return the cached results for key, or None on a miss """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                results = pickle.loads(zlib.decompress(f.read()))
+        except (OSError, zlib.error, pickle.UnpicklingError, EOFError):
+            return None
+        # refresh the access time used for eviction
+        os.utime(path)
+        return results
+
+    def put(self, key, results):
+        """ Store the results of a parser under key, then evict old entries
+        if the cache has grown past max_bytes. The folder is only scanned
+        when that happens, not on every put """
+        if self._size is None:
+            self._size = self._scan()[1]
+        path = self._path(key)
+        tmp = path + '.tmp'
+        data = zlib.compress(pickle.dumps(results, pickle.HIGHEST_PROTOCOL))
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        os.replace(tmp, path)
+        self._size += len(data) - replaced
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def _scan(self):
+        """ (mtime, size, path) of every entry, and their total size """
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.bin'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        return entries, total
+
+    def evict(self):
+        """ Delete least recently used entries until the cache fits in max_bytes """
+        entries, total = self._scan()
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+        self._size = total
+
+    def clear(self):
+        """ Remove every entry from the cache """
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.bin'):
+                os.remove(entry.path)
+        self._size = 0
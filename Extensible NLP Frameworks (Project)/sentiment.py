@@ -0,0 +1,325 @@
+"""
+File: sentiment.py
+
+Description: Pluggable sentiment engines for GovSnatch.
+An engine scores a list of sentences and returns their
+polarity and subjectivity as two NumPy arrays. SentenceSentiment
+keeps those per-sentence scores for a document, and only runs the
+engine once they are first asked for.
+
+"""
+
+
+from functools import lru_cache
+import time
+
+import numpy as np
+import textblob as tb
+from textblob.en import sentiment as pattern_sentiment
+from textblob.en.sentiments import PatternAnalyzer
+from textblob._text import EMOTICONS, PUNCTUATION
+
+
+NEGATIONS = ('no', 'not', "n't", 'never')
+
+
+@lru_cache(maxsize=None)
+def load_lexicon():
+    """ Load the pattern sentiment lexicon bundled with TextBlob into
+    arrays indexed by word id. Loaded once per process.
+
+    Returns:
+    - index: dict of word -> word id
+    - scores: float array of shape (n, 3) with polarity, subjectivity, intensity
+    - modifier: bool array, True for words that can modify the next word (adverbs)
+    """
+    if dict.__len__(pattern_sentiment) == 0:
+        pattern_sentiment.load()
+
+    index = {}
+    scores = []
+    modifier = []
+    for word, senses in dict.items(pattern_sentiment):
+        index[word] = len(scores)
+        scores.append(senses[None])
+        modifier.append('RB' in senses)
+    return index, np.array(scores, dtype=np.float64), np.array(modifier, dtype=bool)
+
+
+@lru_cache(maxsize=None)
+def _emoticons():
+    """ Map each lowercase emoticon to its polarity, first match wins like pattern """
+    scores = {}
+    for (_, polarity), faces in EMOTICONS.items():
+        for face in faces:
+            scores.setdefault(face.lower(), polarity)
+    return scores
+
+
+class TextBlobSentiment:
+    """ Scores each sentence with TextBlob's PatternAnalyzer, one at a time """
+
+    def __init__(self):
+        self.analyzer = PatternAnalyzer()
+
+    def score(self, sentences):
+        """ Return (polarity, subjectivity) arrays for a list of sentence strings """
+        polarity = np.zeros(len(sentences))
+        subjectivity = np.zeros(len(sentences))
+        for i, sentence in enumerate(sentences):
+            polarity[i], subjectivity[i] = self.analyzer.analyze(sentence)
+        return polarity, subjectivity
+
+
+class LexiconSentiment:
+    """ Scores all sentences of a document in one batched pass over an
+    array-backed copy of the pattern lexicon.
+
+    Sentences made only of plain lexicon words are scored with a vectorized
+    mean. Sentences containing negations, adverb modifiers, exclamation marks
+    or emoticons are rescored with a port of pattern's assessment rules, so
+    results match TextBlobSentiment up to floating point rounding.
+    """
+
+    def __init__(self):
+        # word -> (word id or -1, needs the exact assessment rules)
+        self._tokens = {}
+
+    def _classify(self, word):
+        """ Look up a lowercase token in the lexicon, caching the answer """
+        index, _, modifier = load_lexicon()
+        word_id = index.get(word, -1)
+        special = (word in NEGATIONS or word in ('!', '(!)')
+                   or (word_id >= 0 and modifier[word_id])
+                   or self._emoticon(word) is not None)
+        self._tokens[word] = (word_id, special)
+        return word_id, special
+
+    @staticmethod
+    def _emoticon(word):
+        """ Polarity of an emoticon token, or None if the token is not one """
+        if word.isalpha() is False and len(word) <= 5 and word not in PUNCTUATION:
+            return _emoticons().get(word)
+        return None
+
+    @staticmethod
+    def tokenize(sentence):
+        """ Split a sentence into lowercase tokens the same way pattern does """
+        return [word.lower() for word in ' '.join(pattern_sentiment.tokenizer(sentence)).split()]
+
+    def score(self, sentences):
+        """ Return (polarity, subjectivity) arrays for a list of sentence strings """
+        _, scores, _ = load_lexicon()
+        tokenized = [self.tokenize(sentence) for sentence in sentences]
+
+        word_ids = []
+        owners = []
+        special = np.zeros(len(sentences), dtype=bool)
+        for i, words in enumerate(tokenized):
+            for word in words:
+                word_id, is_special = self._tokens.get(word) or self._classify(word)
+                if word_id >= 0:
+                    word_ids.append(word_id)
+                    owners.append(i)
+                special[i] |= is_special
+
+        # plain sentences: the average score of the lexicon words they contain
+        word_ids = np.array(word_ids, dtype=np.intp)
+        owners = np.array(owners, dtype=np.intp)
+        counts = np.bincount(owners, minlength=len(sentences))
+        denominator = np.maximum(counts, 1)
+        polarity = np.bincount(owners, weights=scores[word_ids, 0], minlength=len(sentences)) / denominator
+        subjectivity = np.bincount(owners, weights=scores[word_ids, 1], minlength=len(sentences)) / denominator
+
+        for i in np.flatnonzero(special):
+            polarity[i], subjectivity[i] = self._assess(tokenized[i])
+        return polarity, subjectivity
+
+    def _assess(self, words):
+        """ Port of pattern's Sentiment.assessments() and averaging for one
+        tokenized sentence, including negation, modifier and emoticon rules """
+        index, scores, modifier = load_lexicon()
+        # each assessment is [polarity, subjectivity, intensity, negated]
+        a = []
+        m = None  # preceding modifier
+        n = None  # preceding negation
+        for w in words:
+            word_id = index.get(w, -1)
+            if word_id >= 0:
+                p, s, i = scores[word_id]
+                if m is None:
+                    a.append([p, s, i, False])
+                else:
+                    a[-1][0] = max(-1.0, min(p * a[-1][2], +1.0))
+                    a[-1][1] = max(-1.0, min(s * a[-1][2], +1.0))
+                    a[-1][2] = i
+                if n is not None:
+                    a[-1][2] = 1.0 / a[-1][2]
+                    a[-1][3] = True
+                m = w if modifier[word_id] else None
+                n = w if w in NEGATIONS else None
+            else:
+                if w in NEGATIONS:
+                    n = w
+                elif n and len(w.strip("'")) > 1:
+                    n = None
+                if n is not None and m is not None and m.endswith('ly'):
+                    a[-1][3] = True
+                    n = None
+                elif m and len(w) > 2:
+                    m = None
+                if w == '!' and len(a) > 0:
+                    a[-1][0] = max(-1.0, min(a[-1][0] * 1.25, +1.0))
+                if w == '(!)':
+                    a.append([0.0, 1.0, 1.0, False])
+                emoticon = self._emoticon(w)
+                if emoticon is not None:
+                    a.append([emoticon, 1.0, 1.0, False])
+
+        polarity = sum(p * -0.5 if negated else p for p, _, _, negated in a)
+        subjectivity = sum(s for _, s, _, _ in a)
+        return polarity / float(len(a) or 1), subjectivity / float(len(a) or 1)
+
+
+class SentenceSentiment:
+    """ Polarity, subjectivity and word count of every sentence of one
+    document, stored as compact float32 / int32 arrays.
+
+    Built from text, nothing is scored until a score or average is first
+    requested; the text is then split into sentences, scored with the engine
+    and dropped. Until then the whole text is held, unless it is given as
+    the name of a UTF-8 file to read it back from, and it is scored before
+    being pickled rather than shipped along. Averages are taken before the
+    float32 conversion, so they are exactly what averaging the engine's
+    output gives.
+    """
+
+    AVERAGES = ('avg polarity', 'avg subjectivity', 'avg sentence length')
+
+    def __init__(self, text=None, engine=None, source=None):
+        """ Constructor
+
+        Parameters:
+        - text: Document text, scored on first use
+        - engine: Sentiment engine with a score(sentences) method
+        - source: Optional file holding the text, read when it is scored
+          instead of holding text in memory until then
+        """
+        self._text = text
+        self._source = source
+        self._engine = engine
+        self._arrays = None
+        self._averages = None
+        # optional callable(seconds, sentences) told when lazy scoring runs;
+        # local to this process, so it is not pickled
+        self.listener = None
+
+    def __getstate__(self):
+        self.evaluate()
+        state = self.__dict__.copy()
+        state['listener'] = None
+        return state
+
+    @classmethod
+    def from_scores(cls, polarity, subjectivity, sentence_words, averages=None):
+        """ Wrap per-sentence values a parser has already computed. averages
+        overrides the AVERAGES, e.g. when a parser summed in its own order """
+        sentiment = cls()
+        sentiment._set(polarity, subjectivity, sentence_words, averages)
+        return sentiment
+
+    def _set(self, polarity, subjectivity, sentence_words, averages=None):
+        n = len(polarity)
+        self._averages = averages or {
+            'avg polarity': sum(polarity) / n if n > 0 else 0,
+            'avg subjectivity': sum(subjectivity) / n if n > 0 else 0,
+            'avg sentence length': sum(sentence_words) / n if n > 0 else 0,
+        }
+        self._arrays = {
+            'polarity': np.asarray(polarity, dtype=np.float32),
+            'subjectivity': np.asarray(subjectivity, dtype=np.float32),
+            'sentence words': np.asarray(sentence_words, dtype=np.int32),
+        }
+        self._text = None
+        self._source = None
+        self._engine = None
+
+    def evaluate(self):
+        """ Score the document now if that has not happened yet """
+        if self._arrays is None:
+            start = time.perf_counter()
+            text = self._text
+            if text is None:
+                with open(self._source, 'r', encoding='utf-8') as f:
+                    text = f.read()
+            sentences = tb.TextBlob(text).sentences
+            polarity, subjectivity = self._engine.score([sentence.raw for sentence in sentences])
+            self._set(polarity, subjectivity, [len(sentence.words) for sentence in sentences])
+            if self.listener is not None:
+                self.listener(time.perf_counter() - start, len(sentences))
+        return self
+
+    @property
+    def evaluated(self):
+        return self._arrays is not None
+
+    @property
+    def polarity(self):
+        return self.evaluate()._arrays['polarity']
+
+    @property
+    def subjectivity(self):
+        return self.evaluate()._arrays['subjectivity']
+
+    @property
+    def sentence_words(self):
+        return self.evaluate()._arrays['sentence words']
+
+    def __len__(self):
+        return len(self.polarity)
+
+    def average(self, name):
+        """ One of AVERAGES over the whole document """
+        return self.evaluate()._averages[name]
+
+    def deferred(self, name):
+        """ A placeholder for average(name) that is only resolved when read """
+        return Deferred(self.average, name)
+
+    def rolling(self, window, metric='polarity'):
+        """ Mean of a per-sentence metric ('polarity', 'subjectivity' or
+        'sentence words') over every run of window consecutive sentences """
+        if window < 1:
+            raise ValueError(f'window must be at least 1, got {window}')
+        values = self.evaluate()._arrays[metric]
+        if len(values) < window:
+            return np.zeros(0, dtype=np.float32)
+        sums = np.concatenate(([0.0], np.cumsum(values, dtype=np.float64)))
+        return ((sums[window:] - sums[:-window]) / window).astype(np.float32)
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.evaluate()._arrays.values())
+
+
+class Deferred:
+    """ A metric value that is computed by func(*args) the first time it is read """
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def resolve(self):
+        return self.func(*self.args)
+
+
+def fidelity(sentences, engine=None, reference=None):
+    """ Compare an engine against TextBlob on a list of sentences.
+    Returns the absolute difference of the average polarity and
+    of the average subjectivity between the two. """
+    engine = engine if engine is not None else LexiconSentiment()
+    reference = reference if reference is not None else TextBlobSentiment()
+    polarity, subjectivity = engine.score(sentences)
+    expected_polarity, expected_subjectivity = reference.score(sentences)
+    return (abs(polarity.mean() - expected_polarity.mean()),
+            abs(subjectivity.mean() - expected_subjectivity.mean()))
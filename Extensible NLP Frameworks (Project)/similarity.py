@@ -0,0 +1,244 @@
+"""
+File: similarity.py
+
+Description: Which documents sound alike, and which words set groups
+of documents apart. Builds a sparse documents x terms matrix from the
+counts in GovSnatch.data and computes TF-IDF weights, cosine
+similarity (in row blocks, so tens of thousands of documents fit in
+memory) and log-odds ratios with an informative Dirichlet prior.
+Results are cached until a document is added or removed.
+
+    engine = SimilarityEngine(analyzer)
+    engine.most_similar('Fox News (Conservative)', k=3)
+    engine.distinctive_terms('conservative', 'liberal', k=10)
+
+"""
+
+
+import matplotlib.pyplot as plt
+import numpy as np
+from scipy import sparse
+
+
+class SimilarityEngine:
+
+    def __init__(self, analyzer, kind='wordcount'):
+        """ Constructor
+
+        Parameters:
+        - analyzer: The GovSnatch instance whose documents are compared
+        - kind: Which counts to use: 'wordcount', 'bigramcount' or 'trigramcount'
+        """
+        self.analyzer = analyzer
+        self.kind = kind
+        self._version = None
+        self._cache = {}
+
+    def _cached(self, key, compute):
+        """ Return a cached result, recomputing everything once documents change """
+        version = self.analyzer.stats.version
+        if version != self._version:
+            self._cache.clear()
+            self._version = version
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
+
+    def _build(self):
+        """ (counts matrix, document labels, terms) for the current documents """
+        store = self.analyzer.store
+        if store is not None:
+            counts = store.counts[self.kind]
+            return counts.matrix().tocsr(), list(counts.labels), [counts.decode(i) for i in range(len(counts.vocab))]
+
+        term_ids = {}
+        indptr = [0]
+        indices = []
+        data = []
+        labels = []
+        for label, counter in self.analyzer.data[self.kind].items():
+            for term, count in counter.items():
+                if count > 0:
+                    indices.append(term_ids.setdefault(term, len(term_ids)))
+                    data.append(count)
+            indptr.append(len(indices))
+            labels.append(label)
+        matrix = sparse.csr_matrix((np.array(data, dtype=np.float64), np.array(indices, dtype=np.int64),
+                                    np.array(indptr, dtype=np.int64)), shape=(len(labels), len(term_ids)))
+        matrix.sum_duplicates()
+        return matrix, labels, list(term_ids)
+
+    def counts(self):
+        """ The documents x terms count matrix (CSR) """
+        return self._cached('counts', self._build)[0]
+
+    @property
+    def labels(self):
+        """ Document labels, in the row order of every matrix """
+        return self._cached('counts', self._build)[1]
+
+    @property
+    def terms(self):
+        """ Terms, in the column order of every matrix """
+        return self._cached('counts', self._build)[2]
+
+    def tfidf(self, sublinear=False):
+        """ TF-IDF weights with rows scaled to unit length (CSR).
+
+        Parameters:
+        - sublinear: Use 1 + log(count) instead of the raw count as term frequency
+
+        Uses the smoothed idf = log((1 + n) / (1 + df)) + 1, so terms found in
+        every document keep a small positive weight.
+        """
+        def compute():
+            matrix = self.counts().copy()
+            if sublinear:
+                matrix.data = 1 + np.log(matrix.data)
+            n = matrix.shape[0]
+            df = np.bincount(matrix.indices, minlength=matrix.shape[1])
+            idf = np.log((1 + n) / (1 + df)) + 1
+            matrix = matrix.multiply(idf).tocsr()
+            norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+            norms[norms == 0] = 1
+            return sparse.diags(1 / norms) @ matrix
+        return self._cached(('tfidf', sublinear), compute)
+
+    def _blocks(self, block_size, sublinear):
+        """ Yield (first row, dense block of cosine similarities) over row blocks """
+        weights = self.tfidf(sublinear)
+        transposed = weights.T.tocsc()
+        for start in range(0, weights.shape[0], block_size):
+            yield start, (weights[start:start + block_size] @ transposed).toarray()
+
+    def similarity(self, block_size=1024, sublinear=False):
+        """ Dense documents x documents cosine similarity of the TF-IDF vectors
+        (float32). Needs n^2 * 4 bytes; use nearest for very large corpora """
+        def compute():
+            n = len(self.labels)
+            result = np.zeros((n, n), dtype=np.float32)
+            for start, block in self._blocks(block_size, sublinear):
+                result[start:start + len(block)] = block
+            return result
+        return self._cached(('similarity', sublinear), compute)
+
+    def nearest(self, k=5, block_size=1024, sublinear=False):
+        """ The k most similar other documents of every document, computed one
+        block of rows at a time so memory grows with n * k rather than n^2.
+
+        Returns:
+        - dict of label -> list of (label, similarity), most similar first
+        """
+        def compute():
+            labels = self.labels
+            result = {}
+            for start, block in self._blocks(block_size, sublinear):
+                rows = np.arange(len(block))
+                block[rows, start + rows] = -np.inf  # not its own neighbour
+                top = min(k, block.shape[1] - 1)
+                if top <= 0:
+                    result.update((labels[start + i], []) for i in rows)
+                    continue
+                candidates = np.argpartition(-block, top - 1, axis=1)[:, :top]
+                scores = np.take_along_axis(block, candidates, axis=1)
+                order = np.argsort(-scores, axis=1, kind='stable')
+                candidates = np.take_along_axis(candidates, order, axis=1)
+                scores = np.take_along_axis(scores, order, axis=1)
+                for i in rows:
+                    result[labels[start + i]] = [(labels[j], float(score))
+                                                 for j, score in zip(candidates[i], scores[i])]
+            return result
+        return self._cached(('nearest', k, sublinear), compute)
+
+    def most_similar(self, label, k=5):
+        """ The k documents most similar to one document, as (label, similarity) """
+        neighbours = self.nearest(k)
+        if label not in neighbours:
+            raise KeyError(label)
+        return neighbours[label]
+
+    def group(self, selector):
+        """ Row indices of a group of documents. selector is a list of labels,
+        or a string matched case-insensitively against the labels, such as
+        'conservative' for labels like 'Fox News (Conservative)' """
+        labels = self.labels
+        if isinstance(selector, str):
+            rows = [i for i, label in enumerate(labels) if selector.lower() in str(label).lower()]
+        else:
+            positions = {label: i for i, label in enumerate(labels)}
+            rows = [positions[label] for label in selector]
+        if not rows:
+            raise ValueError(f'No documents match {selector!r}')
+        return np.array(rows, dtype=np.int64)
+
+    def log_odds(self, group_a, group_b, prior_size=None):
+        """ Log-odds ratio of every term between two groups of documents, with
+        an informative Dirichlet prior taken from the whole corpus (Monroe,
+        Colaresi and Quinn 2008), as z-scores. Positive favours group_a.
+
+        Parameters:
+        - group_a, group_b: Labels or a label keyword (see group)
+        - prior_size: Total weight of the prior. Default: the corpus size,
+          i.e. the corpus counts themselves are the prior
+
+        Returns:
+        - float array of z-scores, one per term (see terms)
+        """
+        key = ('log odds', _key(group_a), _key(group_b), prior_size)
+
+        def compute():
+            counts = self.counts()
+            y_a = np.asarray(counts[self.group(group_a)].sum(axis=0)).ravel()
+            y_b = np.asarray(counts[self.group(group_b)].sum(axis=0)).ravel()
+            background = np.asarray(counts.sum(axis=0)).ravel()
+            alpha = background if prior_size is None else prior_size * background / max(background.sum(), 1)
+            alpha = np.maximum(alpha, 1e-9)
+            alpha_0 = alpha.sum()
+            n_a, n_b = y_a.sum(), y_b.sum()
+
+            delta = (np.log(y_a + alpha) - np.log(n_a + alpha_0 - y_a - alpha)
+                     - np.log(y_b + alpha) + np.log(n_b + alpha_0 - y_b - alpha))
+            variance = 1 / (y_a + alpha) + 1 / (y_b + alpha)
+            return delta / np.sqrt(variance)
+        return self._cached(key, compute)
+
+    def distinctive_terms(self, group_a, group_b, k=20, prior_size=None):
+        """ The k terms most typical of each group compared with the other.
+
+        Returns:
+        - (terms of group_a, terms of group_b), each a list of (term, z-score)
+          with the most distinctive first
+        """
+        z = self.log_odds(group_a, group_b, prior_size)
+        terms = self.terms
+        k = min(k, len(z))
+        if k <= 0:
+            return [], []
+        top = np.argsort(-z, kind='stable')
+        return ([(terms[i], float(z[i])) for i in top[:k]],
+                [(terms[i], float(-z[i])) for i in top[::-1][:k]])
+
+    def plot_similarity(self, figsize=(10, 8), show=True):
+        """ Heatmap of the pairwise cosine similarity of all documents
+
+        Returns:
+        - The matplotlib figure
+        """
+        labels = self.labels
+        fig, ax = plt.subplots(figsize=figsize)
+        image = ax.imshow(self.similarity(), cmap='viridis', vmin=0, vmax=1)
+        ax.set_xticks(range(len(labels)))
+        ax.set_xticklabels(labels, rotation=45, ha='right')
+        ax.set_yticks(range(len(labels)))
+        ax.set_yticklabels(labels)
+        ax.set_title('Document Similarity (TF-IDF cosine)', fontsize=16)
+        fig.colorbar(image, ax=ax)
+        plt.tight_layout()
+        if show:
+            plt.show()
+        return fig
+
+
+def _key(selector):
+    """ A hashable form of a group selector for the cache """
+    return selector if isinstance(selector, str) else tuple(selector)
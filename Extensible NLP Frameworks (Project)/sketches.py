@@ -0,0 +1,280 @@
+"""
+File: sketches.py
+
+Description: Bounded-memory approximate counters for n-gram
+vocabularies too large to count exactly. HeavyHitters combines a
+Count-Min sketch with a Space-Saving summary and can stand in for
+the Counter objects GovSnatch stores for bigrams and trigrams.
+
+"""
+
+
+from collections import Counter, defaultdict
+from collections.abc import Mapping
+import functools
+import hashlib
+import heapq
+import math
+import sys
+
+import numpy as np
+
+
+# splitmix64 constants, for mixing 64 bit hashes with array arithmetic
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+_MIX1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX2 = np.uint64(0x94D049BB133111EB)
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def word_hash(word):
+    """ A 64 bit hash of a word that is the same in every process,
+    unlike hash() on strings """
+    return int.from_bytes(hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def _mix(h):
+    h = (h ^ (h >> np.uint64(30))) * _MIX1
+    h = (h ^ (h >> np.uint64(27))) * _MIX2
+    return h ^ (h >> np.uint64(31))
+
+
+def ngram_hashes(columns):
+    """ 64 bit hashes of n-grams given as n arrays of word hashes, one per
+    position, e.g. word hashes indexed by the word ids of each column """
+    hashes = np.zeros(len(columns[0]), dtype=np.uint64)
+    for column in columns:
+        # uint64 array arithmetic wraps around, as the mixing needs
+        hashes = _mix(hashes * _GOLDEN + np.asarray(column, dtype=np.uint64))
+    return hashes
+
+
+def term_hashes(terms):
+    """ ngram_hashes of a list of terms (words or tuples of words) """
+    terms = [(term,) if isinstance(term, str) else term for term in terms]
+    hashes = np.zeros(len(terms), dtype=np.uint64)
+    by_order = defaultdict(list)
+    for i, term in enumerate(terms):
+        by_order[len(term)].append(i)
+    for order, rows in by_order.items():
+        columns = [np.fromiter((word_hash(terms[i][j]) for i in rows), dtype=np.uint64, count=len(rows))
+                   for j in range(order)]
+        hashes[rows] = ngram_hashes(columns)
+    return hashes
+
+
+class CountMinSketch:
+    """ Count-Min sketch. Estimates never undercount, and overcount by at
+    most epsilon * total with probability 1 - delta. A max_width narrower
+    than epsilon calls for raises epsilon to e / max_width. Terms are
+    counted by their 64 bit hash (see term_hashes) """
+
+    def __init__(self, epsilon=0.001, delta=0.01, max_width=None):
+        self.width = math.ceil(math.e / epsilon)
+        if max_width is not None and max_width < self.width:
+            self.width = max(int(max_width), 1)
+            epsilon = math.e / self.width
+        self.epsilon = epsilon
+        self.delta = delta
+        self.depth = math.ceil(math.log(1 / delta))
+        self.table = np.zeros((self.depth, self.width), dtype=np.int64)
+        self._rows = np.arange(self.depth, dtype=np.uint64)
+        self.total = 0
+
+    def _columns(self, hashes):
+        # double hashing: depth hash functions from one 64 bit hash,
+        # as a (depth, len(hashes)) array of columns
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        h1, h2 = hashes & np.uint64(0xFFFFFFFF), (hashes >> np.uint64(32)) | np.uint64(1)
+        return (h1 + self._rows[:, None] * h2) % np.uint64(self.width)
+
+    def add_hashes(self, hashes, counts):
+        """ Add counts[i] occurrences of the term hashed to hashes[i] """
+        counts = np.asarray(counts, dtype=np.int64)
+        for row, columns in zip(self.table, self._columns(hashes)):
+            np.add.at(row, columns, counts)
+        self.total += int(counts.sum())
+
+    def estimates(self, hashes):
+        """ Estimated number of occurrences of each hashed term """
+        return self.table[self._rows[:, None], self._columns(hashes)].min(axis=0)
+
+    def add(self, term, count=1):
+        """ Add count occurrences of term and return its new estimate """
+        hashes = term_hashes([term])
+        self.add_hashes(hashes, [count])
+        return int(self.estimates(hashes)[0])
+
+    def estimate(self, term):
+        """ Estimated number of occurrences of term """
+        return int(self.estimates(term_hashes([term]))[0])
+
+    @property
+    def nbytes(self):
+        return self.table.nbytes
+
+
+class SpaceSaving:
+    """ Space-Saving summary tracking at most capacity terms. Any term whose
+    true count exceeds total / capacity is guaranteed to be tracked """
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self._heap = []  # (count, seq, term), possibly stale; built once full
+        self._seq = 0
+
+    def add(self, term, count=1):
+        """ Add count occurrences of term """
+        if term in self.counts:
+            self.counts[term] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[term] = count
+            self.errors[term] = 0
+        else:
+            # replace the smallest tracked term, inheriting its count as error
+            smallest, least = self._pop_min()
+            del self.counts[smallest]
+            del self.errors[smallest]
+            self.counts[term] = least + count
+            self.errors[term] = least
+        if self._heap:
+            self._seq += 1
+            heapq.heappush(self._heap, (self.counts[term], self._seq, term))
+
+        if len(self._heap) > 4 * self.capacity:
+            self._rebuild()
+
+    def _rebuild(self):
+        self._heap = [(count, i, term) for i, (term, count) in enumerate(self.counts.items())]
+        self._seq = len(self._heap)
+        heapq.heapify(self._heap)
+
+    def _pop_min(self):
+        if not self._heap:
+            # nothing has been evicted yet, so the heap was never needed
+            self._rebuild()
+        while True:
+            count, _, term = heapq.heappop(self._heap)
+            if self.counts.get(term) == count:
+                return term, count
+
+    @property
+    def nbytes(self):
+        # errors holds the same term objects as counts
+        return _deep_size(self.counts) + sys.getsizeof(self.errors) + sys.getsizeof(self._heap) \
+            + len(self._heap) * sys.getsizeof((0, 0, None))
+
+
+class HeavyHitters(Mapping):
+    """ Approximate, bounded-memory replacement for an n-gram Counter.
+
+    Counts are estimated by a Count-Min sketch, and the most frequent terms
+    are tracked by a Space-Saving summary. Iterating, items() and
+    most_common() cover the tracked terms only, while lookups estimate any
+    term. Memory depends on epsilon, delta and capacity, not on the text.
+    """
+
+    def __init__(self, epsilon=0.001, delta=0.01, capacity=1000, items=None):
+        """ Constructor
+
+        Parameters:
+        - epsilon: Counts are overestimated by at most epsilon * total
+        - delta: Probability that the epsilon bound is exceeded
+        - capacity: Number of most frequent terms tracked for most_common()
+        - items: Optional number of terms that will be counted, e.g. the
+          n-grams of one document. The sketch is made no wider than that, so
+          short documents get small tables; error_bound reports the looser
+          epsilon this gives. Tracked terms stay exact as long as at most
+          capacity distinct terms are seen
+        """
+        self.sketch = CountMinSketch(epsilon, delta, items)
+        self.summary = SpaceSaving(capacity)
+
+    def update(self, terms):
+        """ Count an iterable of terms, or a mapping of term -> count """
+        counts = terms if isinstance(terms, Mapping) else Counter(terms)
+        terms = list(counts)
+        self.update_batch(terms, np.fromiter(counts.values(), dtype=np.int64, count=len(terms)),
+                          term_hashes(terms))
+
+    def update_batch(self, terms, counts, hashes):
+        """ Count distinct terms, given with their counts and hashes (see
+        term_hashes), as Tokenizer.ngram_batches yields them. The sketch
+        takes the whole batch at once """
+        self.sketch.add_hashes(hashes, counts)
+        add = self.summary.add
+        for term, count in zip(terms, counts.tolist()):
+            add(term, count)
+
+    def _estimate(self, term):
+        # both structures only overestimate, so the smaller value is tighter
+        estimate = self.sketch.estimate(term)
+        if term in self.summary.counts:
+            estimate = min(estimate, self.summary.counts[term])
+        return estimate
+
+    def __getitem__(self, term):
+        return self._estimate(term)
+
+    def __contains__(self, term):
+        return term in self.summary.counts
+
+    def __iter__(self):
+        return iter(self.summary.counts)
+
+    def __len__(self):
+        return len(self.summary.counts)
+
+    def get(self, term, default=None):
+        return self._estimate(term) if term in self.summary.counts else default
+
+    def most_common(self, n=None):
+        """ The n tracked terms with the highest estimated counts """
+        terms = list(self.summary.counts)
+        tracked = np.fromiter(self.summary.counts.values(), dtype=np.int64, count=len(terms))
+        estimates = np.minimum(self.sketch.estimates(term_hashes(terms)), tracked).tolist()
+        items = sorted(zip(terms, estimates), key=lambda item: item[1], reverse=True)
+        return items if n is None else items[:n]
+
+    def total(self):
+        return self.sketch.total
+
+    @property
+    def error_bound(self):
+        """ Largest expected overcount of any single estimate """
+        return self.sketch.epsilon * self.sketch.total
+
+    @property
+    def nbytes(self):
+        return self.sketch.nbytes + self.summary.nbytes
+
+
+def _deep_size(counter):
+    """ Approximate memory used by a dict of terms (strings or tuples of strings) """
+    size = sys.getsizeof(counter)
+    for term, count in counter.items():
+        size += sys.getsizeof(term) + sys.getsizeof(count)
+        if isinstance(term, tuple):
+            size += sum(sys.getsizeof(word) for word in term)
+    return size
+
+
+def sketch_report(exact, sketch, k=10):
+    """ Compare a HeavyHitters sketch with the exact Counter of the same terms.
+
+    Returns a dict with the memory of both, the share of the exact top k
+    found in the sketch's top k, and the largest count error over that top k.
+    """
+    exact_top = exact.most_common(k)
+    sketch_top = {term for term, _ in sketch.most_common(k)}
+    found = sum(1 for term, _ in exact_top if term in sketch_top)
+    return {
+        'exact bytes': _deep_size(exact),
+        'sketch bytes': sketch.nbytes,
+        'distinct terms': len(exact),
+        'top k recall': found / len(exact_top) if exact_top else 1.0,
+        'max top k error': max((abs(sketch[term] - count) for term, count in exact_top), default=0),
+        'error bound': sketch.error_bound,
+    }
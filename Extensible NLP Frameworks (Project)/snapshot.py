@@ -0,0 +1,314 @@
+"""
+File: snapshot.py
+
+Description: A compact on-disk format for the analyzed state of a
+GovSnatch corpus, used by GovSnatch.save and GovSnatch.load. Words
+are interned once into a shared vocabulary, n-grams are stored as
+rows of word ids and every count or sentiment series is a NumPy
+array, so a snapshot loads by memory mapping instead of unpickling.
+
+Layout of a snapshot directory:
+    manifest.json              labels, metrics, scalar values and settings
+    vocab.bin, vocab.offsets.npy
+                               UTF-8 words back to back, and where each starts
+    <kind>.indptr.npy          row i of a count kind is [indptr[i], indptr[i+1])
+    <kind>.terms.npy           word ids, one column per word of the n-gram
+    <kind>.counts.npy          (integers use the smallest type that fits)
+    <kind>.total_terms.npy, <kind>.total_counts.npy
+                               the counts summed over all documents, by n-gram
+    sentiment.*.npy            per-sentence arrays, rows like the counts
+    other.pkl                  any value that fits none of the above
+
+"""
+
+
+from collections import Counter
+from collections.abc import Mapping
+import json
+import os
+import pickle
+
+import numpy as np
+
+from sentiment import SentenceSentiment
+
+
+FORMAT_VERSION = 1
+
+# count kinds stored as n-gram rows, and their n
+ORDERS = {'wordcount': 1, 'bigramcount': 2, 'trigramcount': 3}
+
+SENTIMENT_ARRAYS = ('polarity', 'subjectivity', 'sentence words')
+
+
+class SnapshotVocabulary:
+    """ The words of a snapshot, decoded from the memory-mapped buffer the
+    first time they are needed """
+
+    def __init__(self, buffer, offsets):
+        self._buffer = buffer
+        self._offsets = offsets
+        self._words = None
+
+    @property
+    def words(self):
+        """ Object array of the words, indexable by arrays of word ids """
+        if self._words is None:
+            data = bytes(self._buffer)
+            bounds = self._offsets.tolist()
+            self._words = np.array([data[start:end].decode('utf-8') for start, end in zip(bounds, bounds[1:])],
+                                   dtype=object)
+        return self._words
+
+    def decode(self, terms):
+        """ Words (one column) or tuples of words for an (n, order) id array """
+        words = self.words
+        if terms.shape[1] == 1:
+            return words[terms[:, 0]].tolist()
+        return list(zip(*(words[column] for column in terms.T)))
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+
+class SnapshotCounter(Mapping):
+    """ A read-only, Counter-like view of one document's counts inside a
+    loaded snapshot. Terms are decoded on first use; the arrays stay mapped """
+
+    def __init__(self, vocabulary, terms, counts):
+        self._vocabulary = vocabulary
+        self._terms = terms    # (n, order) word ids
+        self._counts = counts  # (n,) counts, in the original counter's order
+        self._keys = None
+        self._lookup = None
+
+    def _decoded(self):
+        if self._keys is None:
+            self._keys = self._vocabulary.decode(self._terms)
+        return self._keys
+
+    def _row(self):
+        if self._lookup is None:
+            self._lookup = dict(zip(self._decoded(), self._counts.tolist()))
+        return self._lookup
+
+    def __getitem__(self, term):
+        # missing terms count as zero, like Counter
+        return self._row().get(term, 0)
+
+    def __contains__(self, term):
+        return term in self._row()
+
+    def __iter__(self):
+        return iter(self._decoded())
+
+    def __len__(self):
+        return len(self._counts)
+
+    def get(self, term, default=None):
+        return self._row().get(term, default)
+
+    def items(self):
+        return zip(self._decoded(), self._counts.tolist())
+
+    def most_common(self, n=None):
+        """ Ties keep the stored order, like Counter.most_common """
+        order = np.argsort(-self._counts.astype(np.int64), kind='stable')
+        if n is not None:
+            order = order[:max(n, 0)]
+        keys = self._decoded()
+        counts = self._counts.tolist()
+        return [(keys[i], counts[i]) for i in order.tolist()]
+
+    def total(self):
+        return int(self._counts.sum())
+
+    def to_counter(self):
+        """ A standalone Counter copy of the counts, in the stored order """
+        return Counter(dict(self.items()))
+
+
+def _compact(values, columns=None):
+    """ values as an array of the smallest unsigned integer type that holds
+    them, reshaped to rows of columns values if given """
+    array = np.array(values, dtype=np.min_scalar_type(max(values, default=0)))
+    return array if columns is None else array.reshape(-1, columns)
+
+
+def _totals(terms, counts, size):
+    """ The distinct n-grams of an (n, order) id array over a vocabulary of
+    size words, in order of first occurrence, and their summed counts """
+    terms = np.asarray(terms, dtype=np.int64)
+    if len(counts) == 0:
+        return terms, np.zeros(0, dtype=np.int64)
+    size = max(size, 1)
+    if size ** terms.shape[1] < 2 ** 63:
+        # pack each n-gram into one integer code
+        codes = terms[:, 0]
+        for column in terms.T[1:]:
+            codes = codes * size + column
+        _, first, inverse = np.unique(codes, return_index=True, return_inverse=True)
+    else:
+        _, first, inverse = np.unique(terms, axis=0, return_index=True, return_inverse=True)
+    sums = np.zeros(len(first), dtype=np.int64)
+    np.add.at(sums, inverse.ravel(), counts)
+    order = np.argsort(first, kind='stable')
+    return terms[first[order]], sums[order]
+
+
+def save(analyzer, path):
+    """ Write the documents of a GovSnatch instance to the directory path.
+    Approximate n-gram counters (HeavyHitters) are saved as the terms they
+    track. Lazy sentiment is scored first. Labels must be strings """
+    os.makedirs(path, exist_ok=True)
+    labels = list(analyzer.metrics)
+    for label in labels:
+        if not isinstance(label, str):
+            raise TypeError(f'Snapshot labels must be strings, got {label!r}')
+
+    word_ids = {}
+    words = []
+    manifest = {
+        'format': FORMAT_VERSION,
+        'labels': labels,
+        'metrics': {label: list(analyzer.metrics[label]) for label in labels},
+        'stop_words': sorted(analyzer.stop_words),
+        'ngram_sketch': analyzer.ngram_sketch,
+        'kinds': {},
+        'sentiment': [],
+        'scalars': {},
+    }
+    other = {}
+
+    for kind, values in analyzer.data.items():
+        present = [label for label in labels if label in values]
+        if not present:
+            continue
+
+        if kind in ORDERS:
+            order = ORDERS[kind]
+            indptr = [0]
+            terms = []
+            counts = []
+            for label in present:
+                for term, count in values[label].items():
+                    for word in ((term,) if order == 1 else term):
+                        word_id = word_ids.get(word)
+                        if word_id is None:
+                            word_id = word_ids[word] = len(words)
+                            words.append(word)
+                        terms.append(word_id)
+                    counts.append(count)
+                indptr.append(len(counts))
+            terms = _compact(terms, order)
+            np.save(os.path.join(path, f'{kind}.indptr.npy'), np.array(indptr, dtype=np.int64))
+            np.save(os.path.join(path, f'{kind}.terms.npy'), terms)
+            np.save(os.path.join(path, f'{kind}.counts.npy'), _compact(counts))
+            # vocabulary still growing, so n-grams are packed with a size that covers it
+            total_terms, total_counts = _totals(terms, counts, int(terms.max(initial=0)) + 1)
+            np.save(os.path.join(path, f'{kind}.total_terms.npy'), total_terms.astype(terms.dtype))
+            np.save(os.path.join(path, f'{kind}.total_counts.npy'), _compact(total_counts.tolist()))
+            manifest['kinds'][kind] = present
+
+        elif kind == 'sentiment':
+            series = [values[label] for label in present]
+            indptr = np.zeros(len(series) + 1, dtype=np.int64)
+            indptr[1:] = np.cumsum([len(sentiment) for sentiment in series])
+            np.save(os.path.join(path, 'sentiment.indptr.npy'), indptr)
+            for name in SENTIMENT_ARRAYS:
+                array = np.concatenate([getattr(sentiment, name.replace(' ', '_')) for sentiment in series])
+                if name == 'sentence words':
+                    array = _compact(array.tolist())
+                np.save(os.path.join(path, f'sentiment.{name.replace(" ", "_")}.npy'), array)
+            manifest['sentiment'] = present
+
+        else:
+            for label in present:
+                value = values[label]
+                if isinstance(value, (bool, int, float, np.integer, np.floating)):
+                    manifest['scalars'].setdefault(kind, {})[label] = value.item() \
+                        if isinstance(value, np.generic) else value
+                else:
+                    other.setdefault(kind, {})[label] = value
+
+    encoded = [word.encode('utf-8') for word in words]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(word) for word in encoded])
+    with open(os.path.join(path, 'vocab.bin'), 'wb') as f:
+        f.write(b''.join(encoded))
+    np.save(os.path.join(path, 'vocab.offsets.npy'), offsets)
+
+    if other:
+        with open(os.path.join(path, 'other.pkl'), 'wb') as f:
+            pickle.dump(other, f, pickle.HIGHEST_PROTOCOL)
+    with open(os.path.join(path, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+
+
+def load(path):
+    """ Read a snapshot directory written by save.
+
+    Returns:
+    - settings: dict with the stop words and ngram_sketch of the saved instance
+    - documents: list of (label, results, metrics) in their saved order
+    - totals: function taking a kind and returning a Counter of its counts
+      summed over all documents, decoded from the stored totals (or summed
+      from the arrays for snapshots saved without them)
+    """
+    with open(os.path.join(path, 'manifest.json'), encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('format') != FORMAT_VERSION:
+        raise ValueError(f'Unsupported snapshot format: {manifest.get("format")}')
+
+    def array(name):
+        return np.load(os.path.join(path, name), mmap_mode='r')
+
+    vocab_size = os.path.getsize(os.path.join(path, 'vocab.bin'))
+    buffer = np.memmap(os.path.join(path, 'vocab.bin'), dtype=np.uint8, mode='r') if vocab_size else b''
+    vocabulary = SnapshotVocabulary(buffer, array('vocab.offsets.npy'))
+    results = {label: {} for label in manifest['labels']}
+    arrays = {}
+
+    for kind, present in manifest['kinds'].items():
+        indptr = array(f'{kind}.indptr.npy').tolist()
+        terms = array(f'{kind}.terms.npy')
+        counts = array(f'{kind}.counts.npy')
+        arrays[kind] = (terms, counts)
+        for i, label in enumerate(present):
+            start, end = indptr[i], indptr[i + 1]
+            results[label][kind] = SnapshotCounter(vocabulary, terms[start:end], counts[start:end])
+
+    for kind, values in manifest['scalars'].items():
+        for label, value in values.items():
+            results[label][kind] = value
+
+    if manifest['sentiment']:
+        indptr = array('sentiment.indptr.npy').tolist()
+        columns = [array(f'sentiment.{name.replace(" ", "_")}.npy') for name in SENTIMENT_ARRAYS]
+        for i, label in enumerate(manifest['sentiment']):
+            start, end = indptr[i], indptr[i + 1]
+            averages = {name: results[label][name] for name in SentenceSentiment.AVERAGES
+                        if name in results[label]}
+            results[label]['sentiment'] = SentenceSentiment.from_scores(
+                *(column[start:end] for column in columns),
+                averages=averages if len(averages) == len(SentenceSentiment.AVERAGES) else None)
+
+    other_path = os.path.join(path, 'other.pkl')
+    if os.path.exists(other_path):
+        with open(other_path, 'rb') as f:
+            for kind, values in pickle.load(f).items():
+                for label, value in values.items():
+                    results[label][kind] = value
+
+    settings = {'stop_words': manifest['stop_words'], 'ngram_sketch': manifest['ngram_sketch']}
+    documents = [(label, results[label], manifest['metrics'][label]) for label in manifest['labels']]
+
+    def totals(kind):
+        if kind not in arrays:
+            return Counter()
+        if os.path.exists(os.path.join(path, f'{kind}.total_terms.npy')):
+            terms, counts = array(f'{kind}.total_terms.npy'), array(f'{kind}.total_counts.npy')
+        else:
+            terms, counts = _totals(*arrays[kind], len(vocabulary))
+        return Counter(dict(zip(vocabulary.decode(terms), counts.tolist())))
+    return settings, documents, totals
@@ -0,0 +1,163 @@
+"""
+File: test_parsers.py
+
+Description: Checks that the streaming and memory mapped parsers give
+the same results as simple_text_parser on the bundled articles.
+
+Run with:
+    python -m pytest test_parsers.py
+
+"""
+
+
+import functools
+import glob
+import os
+import types
+
+import pytest
+
+from new_textastic import GovSnatch, _callable_id
+from parse_cache import ParseCache
+from sentiment import Deferred
+from tokenizer import Tokenizer
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ARTICLES = sorted(glob.glob(os.path.join(HERE, '*_*.txt')))
+COUNTERS = ('wordcount', 'bigramcount', 'trigramcount')
+AVERAGES = ('numwords', 'avg polarity', 'avg subjectivity', 'avg sentence length', 'readability score')
+
+
+def _value(results, name):
+    value = results[name]
+    return value.resolve() if isinstance(value, Deferred) else value
+
+
+@pytest.fixture(scope='module')
+def analyzer():
+    analyzer = GovSnatch()
+    analyzer.load_stop_words(os.path.join(HERE, 'stopwords.txt'))
+    return analyzer
+
+
+@pytest.mark.parametrize('filename', ARTICLES, ids=os.path.basename)
+def test_stream_matches_simple(analyzer, filename):
+    expected = analyzer.simple_text_parser(filename)
+    # every article fits in the default chunk, so it is parsed whole
+    results = analyzer.stream_text_parser(filename)
+    for name in COUNTERS:
+        assert results[name] == expected[name]
+    for name in AVERAGES:
+        assert _value(results, name) == pytest.approx(_value(expected, name), abs=1e-12)
+
+
+@pytest.mark.parametrize('filename', ARTICLES, ids=os.path.basename)
+def test_stream_chunks_keep_counts(analyzer, filename):
+    expected = analyzer.simple_text_parser(filename)
+    # small chunks split sentences, but never words or n-grams
+    results = analyzer.stream_text_parser(filename, chunk_size=100)
+    for name in COUNTERS:
+        assert results[name] == expected[name]
+    assert results['numwords'] == expected['numwords']
+    assert results['readability score'] == pytest.approx(expected['readability score'], abs=1e-12)
+
+
+def test_read_segments_whole_file(tmp_path):
+    path = tmp_path / 'doc.txt'
+    path.write_text('First line.\nSecond line without a break', encoding='utf-8')
+    assert list(GovSnatch.read_segments(str(path))) == [path.read_text(encoding='utf-8')]
+    pieces = list(GovSnatch.read_segments(str(path), chunk_size=8))
+    assert ''.join(pieces) == path.read_text(encoding='utf-8')
+    assert all(piece.endswith(('\n', ' ')) for piece in pieces[:-1])
+
+
+class TaggingGovSnatch(GovSnatch):
+    """ A subclass whose parser adds a metric, to check it is used in workers """
+
+    def simple_text_parser(self, filename):
+        results = super().simple_text_parser(filename)
+        results['tagged'] = os.path.basename(filename)
+        return results
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_load_texts_uses_subclass_parser(workers):
+    analyzer = TaggingGovSnatch()
+    analyzer.load_stop_words(os.path.join(HERE, 'stopwords.txt'))
+    analyzer.load_texts({filename: None for filename in ARTICLES[:3]}, workers=workers)
+    assert dict(analyzer.data['tagged'].items()) == {filename: os.path.basename(filename)
+                                                     for filename in ARTICLES[:3]}
+
+
+def test_load_texts_rejects_instance_parser():
+    analyzer = GovSnatch()
+    analyzer.load_stop_words(os.path.join(HERE, 'stopwords.txt'))
+
+    def only_here(self, filename):
+        return self.simple_text_parser(filename)
+    # bound to this instance only, so a worker has no way to find it
+    analyzer.register_parser('here', types.MethodType(only_here, analyzer))
+    with pytest.raises(ValueError):
+        analyzer.load_texts({filename: None for filename in ARTICLES[:2]}, parser='here', workers=2)
+
+
+def _parse_with(analyzer, filename, scale):
+    return analyzer.simple_text_parser(filename)
+
+
+def test_parser_ids_tell_parsers_apart():
+    analyzer = GovSnatch()
+    first = functools.partial(_parse_with, scale=1)
+    second = functools.partial(_parse_with, scale=2)
+    assert _callable_id(first) != _callable_id(second)
+    assert _callable_id(analyzer.simple_text_parser) != _callable_id(TaggingGovSnatch().simple_text_parser)
+    # no stable name, so never cached
+    assert _callable_id(lambda filename: {}) is None
+    named = lambda filename: {}
+    named.cache_id = 'named-v1'
+    assert _callable_id(named) == 'named-v1'
+
+
+def test_parse_cache_tracks_size(tmp_path):
+    cache = ParseCache(str(tmp_path), max_bytes=1000)
+    for i in range(20):
+        cache.put(f'{i:064x}', os.urandom(200))
+    sizes = [entry.stat().st_size for entry in os.scandir(tmp_path)]
+    assert sum(sizes) <= 1000
+    assert cache._size == sum(sizes)
+
+
+@pytest.mark.parametrize('trace_memory', [False, True])
+def test_sink_traces_memory_only_when_asked(trace_memory):
+    records = []
+    analyzer = GovSnatch(sink=records.append, trace_memory=trace_memory)
+    analyzer.load_stop_words(os.path.join(HERE, 'stopwords.txt'))
+    analyzer.simple_text_parser(ARTICLES[0])
+    parses = [record for record in records if record['event'] == 'parse']
+    assert parses and all(('peak traced kb' in record) == trace_memory for record in parses)
+
+
+class SmallWindowTokenizer(Tokenizer):
+    WINDOW = 64
+
+
+@pytest.mark.parametrize('filename', ARTICLES, ids=os.path.basename)
+def test_tokenize_bytes_windows_match_text(filename):
+    with open(filename, 'rb') as f:
+        data = f.read()
+    tokenizer = SmallWindowTokenizer()
+    # windows cut through words and multi-byte characters, never tokens
+    ids = tokenizer.tokenize_bytes(data)
+    assert [tokenizer.words[i] for i in ids] == [tokenizer.words[i] for i in tokenizer.tokenize(data.decode('utf-8'))]
+
+
+def test_lazy_sentiment_rereads_file(analyzer):
+    results = analyzer.simple_text_parser(ARTICLES[0])
+    sentiment = results['sentiment']
+    # only the file name is kept until sentiment is scored
+    assert not sentiment.evaluated and sentiment._text is None
+    with open(ARTICLES[0], 'r', encoding='utf-8') as f:
+        expected = analyzer.parse_text(f.read(), ARTICLES[0])
+    assert _value(results, 'avg polarity') == _value(expected, 'avg polarity')
+    assert list(sentiment.polarity) == list(expected['sentiment'].polarity)
@@ -0,0 +1,41 @@
+"""
+File: test_sentiment.py
+
+Description: Checks that the batched LexiconSentiment engine scores
+the bundled articles like TextBlob, using sentiment.fidelity.
+
+Run with:
+    python -m pytest test_sentiment.py
+
+"""
+
+
+import glob
+import os
+
+import pytest
+import textblob as tb
+
+from sentiment import LexiconSentiment, TextBlobSentiment, fidelity
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ARTICLES = sorted(glob.glob(os.path.join(HERE, '*_*.txt')))
+
+# LexiconSentiment ports pattern's rules exactly, so only float rounding may differ
+TOLERANCE = 1e-9
+
+
+@pytest.fixture(scope='module')
+def engines():
+    return LexiconSentiment(), TextBlobSentiment()
+
+
+@pytest.mark.parametrize('filename', ARTICLES, ids=os.path.basename)
+def test_fidelity(engines, filename):
+    with open(filename, 'r', encoding='utf-8') as f:
+        sentences = [sentence.raw for sentence in tb.TextBlob(f.read()).sentences]
+    engine, reference = engines
+    polarity, subjectivity = fidelity(sentences, engine, reference)
+    assert polarity <= TOLERANCE
+    assert subjectivity <= TOLERANCE
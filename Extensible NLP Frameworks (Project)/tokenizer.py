@@ -0,0 +1,208 @@
+"""
+File: tokenizer.py
+
+Description: A reusable tokenizer stage for GovSnatch parsers.
+Every distinct token is lowercased and checked against the stop
+list exactly once; a document becomes an array of vocabulary ids
+from which word, bigram and trigram counts are derived. UTF-8 bytes,
+such as a memory-mapped file, can be tokenized without decoding the
+whole text.
+
+"""
+
+
+from collections import Counter
+import re
+
+import numpy as np
+
+from sketches import ngram_hashes, word_hash
+
+
+class _TokenIds(dict):
+    """ Maps raw tokens to vocabulary ids, interning unseen tokens on first lookup """
+
+    def __init__(self, intern):
+        super().__init__()
+        self.intern = intern
+
+    def __missing__(self, raw):
+        token_id = self[raw] = self.intern(raw)
+        return token_id
+
+
+class Tokenizer:
+    """ Turns text into arrays of word ids plus a stop word mask.
+
+    The vocabulary grows as new words are seen and is shared by every
+    document tokenized with the same instance. Custom parsers can use it
+    as a building block:
+
+        ids = tokenizer.tokenize(text)
+        words = tokenizer.ngram_counts(ids, 1)
+        bigrams = tokenizer.ngram_counts(ids, 2)
+        for batch in tokenizer.ngram_batches(ids, 3):
+            sketch.update_batch(*batch)
+    """
+
+    # same matches as r'\b\w+\b', since a maximal run of \w is always
+    # bounded by word boundaries, but without the boundary checks
+    PATTERN = re.compile(r'\w+')
+    # the same runs on UTF-8 bytes: ASCII word characters, or any byte of a
+    # multi-byte character. Those runs always hold whole characters, and
+    # intern_bytes splits off the non-word ones (curly quotes, dashes, ...)
+    BYTES_PATTERN = re.compile(rb'(?:[0-9A-Za-z_]|[\x80-\xff])+')
+    # tokenize_bytes reads its buffer in windows of this many bytes
+    WINDOW = 1 << 20
+
+    def __init__(self, stop_words=()):
+        self.stop_words = frozenset(stop_words)
+        self.words = []           # id -> lowercase word
+        self._word_ids = {}       # lowercase word -> id
+        # id -> stop word flag and number of characters, with spare room
+        # at the end so a growing vocabulary rarely copies them
+        self._stop = np.zeros(1024, dtype=np.bool_)
+        self._lengths = np.zeros(1024, dtype=np.int64)
+        # id -> word_hash, filled in for new words when n-grams are hashed
+        self._hashes = np.zeros(0, dtype=np.uint64)
+        self._raw_ids = _TokenIds(self.intern_raw)
+        self._compound = {}       # raw token -> ids, when lowercasing splits it
+        self._byte_ids = _TokenIds(self.intern_bytes)
+        self._byte_compound = {}  # raw byte run -> ids, when it is not exactly one token
+
+    def word_id(self, word):
+        """ The id of a lowercase word, added to the vocabulary if unseen """
+        word_id = self._word_ids.get(word)
+        if word_id is None:
+            word_id = self._word_ids[word] = len(self.words)
+            self.words.append(word)
+            if word_id == len(self._stop):
+                self._stop = np.concatenate([self._stop, np.zeros_like(self._stop)])
+                self._lengths = np.concatenate([self._lengths, np.zeros_like(self._lengths)])
+            self._stop[word_id] = word in self.stop_words
+            self._lengths[word_id] = len(word)
+        return word_id
+
+    def intern_raw(self, raw):
+        """ Normalize a raw token and return its id. A few characters change
+        into several when lowercased and split the token in two; those map to
+        -1 and are expanded separately, matching findall on lowercased text """
+        parts = self.PATTERN.findall(raw.lower())
+        if len(parts) == 1:
+            return self.word_id(parts[0])
+        self._compound[raw] = [self.word_id(part) for part in parts]
+        return -1
+
+    def intern_bytes(self, raw):
+        """ Decode a run of UTF-8 bytes matched by BYTES_PATTERN and return its
+        id. Runs holding other than exactly one token, like 'don\u2019t' or a
+        lone dash, map to -1 and are expanded separately """
+        ids = []
+        for part in self.PATTERN.findall(raw.decode('utf-8')):
+            token_id = self._raw_ids[part]
+            ids.extend(self._compound[part] if token_id < 0 else (token_id,))
+        if len(ids) == 1:
+            return ids[0]
+        self._byte_compound[raw] = ids
+        return -1
+
+    def tokenize(self, text):
+        """ Return the word ids of text as an int32 array """
+        return self._ids(self.PATTERN.findall(text), self._raw_ids, self._compound)
+
+    def tokenize_bytes(self, buffer):
+        """ Return the word ids of UTF-8 encoded bytes (bytes, mmap or any
+        buffer) as an int32 array, the same as tokenize(buffer.decode()).
+        Only the distinct tokens are ever decoded. The buffer is read in
+        windows of WINDOW bytes that never split a token, so besides the
+        ids memory grows with the window and the vocabulary only """
+        parts = []
+        start, size, window = 0, len(buffer), self.WINDOW
+        while start < size:
+            end = min(start + window, size)
+            raw_tokens = self.BYTES_PATTERN.findall(buffer[start:end])
+            if end < size and self.BYTES_PATTERN.fullmatch(buffer[end - 1:end + 1]):
+                # the last token goes on past the window: leave it for the next
+                if len(raw_tokens) <= 1:
+                    window *= 2
+                    continue
+                end -= len(raw_tokens.pop())
+            parts.append(self._ids(raw_tokens, self._byte_ids, self._byte_compound))
+            start = end
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int32)
+
+    @staticmethod
+    def _ids(raw_tokens, raw_ids, compound):
+        ids = np.fromiter(map(raw_ids.__getitem__, raw_tokens), dtype=np.int64, count=len(raw_tokens))
+        if compound and (ids < 0).any():
+            ids = np.array([i for raw, token_id in zip(raw_tokens, ids.tolist())
+                            for i in (compound[raw] if token_id < 0 else (token_id,))],
+                           dtype=np.int64)
+        return ids.astype(np.int32)
+
+    def stop_mask(self, ids):
+        """ Boolean array, True where the token is a stop word """
+        return self._stop[ids]
+
+    def num_characters(self, ids):
+        """ Total length of the given tokens """
+        return int(self._lengths[ids].sum())
+
+    def _ngrams(self, ids, n):
+        """ The distinct n-grams in ids made only of non stop words, in order
+        of first occurrence, as n arrays of word ids, and their counts """
+        if len(ids) < n:
+            return [np.zeros(0, dtype=np.int64)] * n, np.zeros(0, dtype=np.int64)
+
+        keep = ~self.stop_mask(ids)
+        valid = keep[:len(ids) - n + 1].copy()
+        for i in range(1, n):
+            valid &= keep[i:len(ids) - n + 1 + i]
+        columns = [ids[i:len(ids) - n + 1 + i][valid].astype(np.int64) for i in range(n)]
+
+        vocab_size = max(len(self.words), 1)
+        if vocab_size ** n < 2 ** 63:
+            # pack each n-gram into one integer code
+            codes = columns[0]
+            for column in columns[1:]:
+                codes = codes * vocab_size + column
+            _, first, counts = np.unique(codes, return_index=True, return_counts=True)
+        else:
+            _, first, counts = np.unique(np.stack(columns, axis=1), axis=0,
+                                         return_index=True, return_counts=True)
+
+        order = np.argsort(first, kind='stable')
+        return [column[first[order]] for column in columns], counts[order]
+
+    def _terms(self, columns):
+        """ Words (one column) or tuples of words for arrays of word ids """
+        words = self.words
+        if len(columns) == 1:
+            return [words[i] for i in columns[0].tolist()]
+        return [tuple(words[i] for i in gram) for gram in zip(*(column.tolist() for column in columns))]
+
+    def ngram_counts(self, ids, n=1):
+        """ Counter of the n-grams in ids made only of non stop words.
+        Keys are words for n=1 and tuples of words otherwise, in order of
+        first occurrence like Counter built from a list """
+        columns, counts = self._ngrams(ids, n)
+        return Counter(dict(zip(self._terms(columns), counts.tolist())))
+
+    def word_hashes(self):
+        """ word_hash of every word, indexable by word ids """
+        if len(self._hashes) < len(self.words):
+            new = self.words[len(self._hashes):]
+            self._hashes = np.concatenate([self._hashes,
+                                           np.fromiter(map(word_hash, new), dtype=np.uint64, count=len(new))])
+        return self._hashes
+
+    def ngram_batches(self, ids, n=1, batch_size=1 << 16):
+        """ Yield the n-gram counts of ids in pieces, each covering the n-grams
+        that start in batch_size consecutive positions, as (terms, counts,
+        hashes) for HeavyHitters.update_batch. Hashes are computed from the
+        word ids of a whole batch at once, and memory stays bounded by
+        batch_size rather than by the number of distinct n-grams """
+        for start in range(0, len(ids) - n + 1, batch_size):
+            columns, counts = self._ngrams(ids[start:start + batch_size + n - 1], n)
+            hashes = self.word_hashes()
+            yield self._terms(columns), counts, ngram_hashes([hashes[column] for column in columns])
@@ -6,10 +6,22 @@ Feb 10 2024
 """
 
 import csv
+import hashlib
+import json
 import matplotlib.pyplot as plt
+import numpy as np
 import statistics
 import os
 
+# parsed races are kept as .npy columns in this folder next to the csv files
+CACHE_DIR = ".npcache"
+CACHE_FORMAT = 1
+RACE_COLUMNS = ('seconds', 'age', 'gender', 'genders', 'country', 'countries')
+
+# time_to_seconds gives this for a missing or malformed time with
+# errors="coerce"
+MISSING_TIME = -1
+
 def read_csv(filename):
     ''' 
     given the name of a csv file, return its contents as a 2d list,
@@ -132,6 +144,564 @@ def file_sorted_dct(all_files):
         sorted_dct[i] = newdct[i]
     return sorted_dct
 
+def time_to_seconds(lst, errors="raise"):
+    '''
+    Convert a whole column of finish times to seconds at once. A time is
+    H:M:S with 1 to 6 hour digits, minutes and seconds of one or two digits
+    below 60 (so '2:07:57' and '2:7:57' are the same) and optional
+    surrounding spaces. Unlike splitting on ':' and calling int(), signs,
+    spaces inside a time, non ASCII digits and minutes or seconds of 60 or
+    more are rejected on purpose
+    Parameters: lst (list or array of time strings), errors ("raise" to
+                raise ValueError naming the first missing or malformed
+                time, "coerce" to give MISSING_TIME for those instead)
+    Return: int32 array
+    '''
+    if errors not in ("raise", "coerce"):
+        raise ValueError('errors must be "raise" or "coerce"')
+    times = np.char.strip(np.asarray(lst, dtype=str))
+    if times.ndim != 1:
+        raise ValueError("expected a list of times")
+    seconds = np.full(len(times), MISSING_TIME, dtype=np.int32)
+    if len(times) == 0:
+        return seconds
+    # the characters as a matrix of code points, one row per time and 0
+    # after its end
+    width = max(times.dtype.itemsize // 4, 1)
+    chars = np.ascontiguousarray(times, dtype="U%d" % width) \
+        .view(np.uint32).reshape(len(times), width).astype(np.int32)
+    length = np.char.str_len(times)
+    digits = chars - ord("0")
+    is_digit = (digits >= 0) & (digits <= 9)
+    is_colon = chars == ord(":")
+    past_end = np.arange(width) >= length[:, None]
+
+    # the two colons split the hours, minutes and seconds
+    first = is_colon.argmax(axis=1)
+    last = width - 1 - is_colon[:, ::-1].argmax(axis=1)
+    minute_digits = last - first - 1
+    second_digits = length - last - 1
+    valid = ((is_digit | is_colon | past_end).all(axis=1)
+             & (is_colon.sum(axis=1) == 2)
+             & (first >= 1) & (first <= 6)
+             & (minute_digits >= 1) & (minute_digits <= 2)
+             & (second_digits >= 1) & (second_digits <= 2))
+
+    rows = np.arange(len(times))
+    def field(end, count):
+        # the one or two digits just before column end
+        ones = digits[rows, np.clip(end - 1, 0, width - 1)]
+        tens = digits[rows, np.clip(end - 2, 0, width - 1)]
+        return np.where(count == 2, tens * 10 + ones, ones)
+    minutes = field(last, minute_digits)
+    secs = field(length, second_digits)
+    # at most 6 hour digits fit in an int32 of seconds
+    hours = np.zeros(len(times), dtype=np.int64)
+    for column in range(min(width, 6)):
+        hours = np.where(column < first, hours * 10 + digits[:, column], hours)
+    total = hours * 3600 + minutes * 60 + secs
+    valid &= ((minutes < 60) & (secs < 60)
+              & (total <= np.iinfo(np.int32).max))
+    seconds[valid] = total[valid]
+
+    if errors == "raise" and not valid.all():
+        row = int(np.flatnonzero(~valid)[0])
+        kind = "Missing" if times[row] == "" else "Malformed"
+        raise ValueError(f"{kind} time {lst[row]!r} in row {row}")
+    return seconds
+
+def seconds_to_time(seconds):
+    '''
+    Turn a number of seconds (rounded to a whole second) back into a time
+    Parameter: seconds (number)
+    Return: time (HH:MM:SS, zero padded)
+    '''
+    seconds = round(seconds)
+    hours = seconds // 3600
+    minutes = (seconds % 3600) // 60
+    remaining_seconds = seconds % 60
+    return f'{hours:02d}:{minutes:02d}:{remaining_seconds:02d}'
+
+def _join_times(seconds, hour_width):
+    '''
+    Build the time strings of format_times and official_times
+    Parameters: seconds (array of whole seconds), hour_width (digits the
+    hours are zero padded to)
+    Return: array of strings
+    '''
+    seconds = np.asarray(seconds, dtype=np.int64)
+    hours, rest = np.divmod(np.maximum(seconds, 0), 3600)
+    minutes, secs = np.divmod(rest, 60)
+    times = np.char.add(np.char.add(np.char.zfill(hours.astype(str), hour_width), ":"),
+                        np.char.add(np.char.zfill(minutes.astype(str), 2), ":"))
+    times = np.char.add(times, np.char.zfill(secs.astype(str), 2))
+    return np.where(seconds < 0, "", times)
+
+def format_times(seconds):
+    '''
+    Turn a whole column of seconds back into zero padded HH:MM:SS times;
+    MISSING_TIME (or any negative number) becomes an empty string
+    Parameter: seconds (array of whole seconds)
+    Return: array of strings
+    '''
+    return _join_times(seconds, 2)
+
+def official_times(seconds):
+    '''
+    Like format_times, but with the hours unpadded (H:MM:SS), written
+    exactly like the OfficialTime column of the data files
+    Parameter: seconds (array of whole seconds)
+    Return: array of strings
+    '''
+    return _join_times(seconds, 1)
+
+def categorical(lst):
+    '''
+    Encode a list of strings as integer codes into a list of categories.
+    The categories are kept in order of first appearance, so when two
+    categories tie for the most common, the lower code is the one seen
+    first (the same tie-break as statistics.mode)
+    Parameter: lst (list of strings)
+    Return: tuple (int32 array of codes, array of categories)
+    '''
+    categories, first, inverse = np.unique(np.array(lst, dtype=str),
+                                           return_index=True,
+                                           return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty(len(order), dtype=np.int32)
+    rank[order] = np.arange(len(order))
+    return rank[inverse.ravel()], categories[order]
+
+def load_race(filename):
+    '''
+    Parse one marathon csv file once into typed columns: finish time in
+    seconds, age as a float, gender and country of residence as
+    categorical codes (see categorical)
+    Parameter: filename (string)
+    Return: dictionary of column name -> array, with the categories of
+            the coded columns under 'genders' and 'countries'
+    '''
+    times, ages, genders, countries = [], [], [], []
+    with open(filename, "r") as infile:
+        csvfile = csv.reader(infile)
+        header = next(csvfile)
+        time_col = header.index('OfficialTime')
+        age_col = header.index('AgeOnRaceDay')
+        gender_col = header.index('Gender')
+        country_col = header.index('CountryOfResAbbrev')
+        for row in csvfile:
+            times.append(row[time_col])
+            ages.append(row[age_col])
+            genders.append(row[gender_col])
+            countries.append(row[country_col])
+    try:
+        finish = time_to_seconds(times)
+    except ValueError as error:
+        # rows counted from the first line after the header
+        raise ValueError(f"{filename}: {error}") from None
+    race = {'seconds': finish,
+            'age': np.array(ages, dtype=np.float64)}
+    race['gender'], race['genders'] = categorical(genders)
+    race['country'], race['countries'] = categorical(countries)
+    return race
+
+def file_hash(filename):
+    '''
+    SHA-256 of a file's contents
+    Parameter: filename (string)
+    Return: string (hex digest)
+    '''
+    digest = hashlib.sha256()
+    with open(filename, "rb") as infile:
+        for block in iter(lambda: infile.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def cache_path(filename):
+    '''
+    The folder holding the binary cache of a csv file,
+    e.g. marathon_data/.npcache/boston_marathon_2011
+    Parameter: filename (string)
+    Return: string
+    '''
+    name = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(os.path.dirname(filename), CACHE_DIR, name)
+
+def save_race_cache(filename, race, source):
+    '''
+    Write the columns of a race as .npy files, plus a source.json saying
+    which version of the csv they came from. source.json is written last,
+    so a half written cache is never used
+    Parameters: filename (string, the csv), race (dictionary, see
+                load_race), source (dictionary of the csv's mtime, size
+                and hash)
+    '''
+    path = cache_path(filename)
+    os.makedirs(path, exist_ok=True)
+    for column in RACE_COLUMNS:
+        np.save(os.path.join(path, column + ".npy"), np.asarray(race[column]))
+    with open(os.path.join(path, "source.json"), "w") as outfile:
+        json.dump({'format': CACHE_FORMAT, **source}, outfile)
+
+def load_race_cache(filename):
+    '''
+    Memory map the cached columns of a csv file, if the cache is still up
+    to date: the csv has the same mtime and size as when the cache was
+    written, or failing that the same contents (then the cache is kept and
+    only its record of the mtime is updated)
+    Parameter: filename (string)
+    Return: tuple (dictionary like load_race or None if the cache is
+            missing or stale, dictionary describing the csv for
+            save_race_cache)
+    '''
+    info = os.stat(filename)
+    source = {'mtime_ns': info.st_mtime_ns, 'size': info.st_size}
+    path = cache_path(filename)
+    try:
+        with open(os.path.join(path, "source.json")) as infile:
+            cached = json.load(infile)
+    except (OSError, ValueError):
+        cached = None
+    if cached is None or cached.get('format') != CACHE_FORMAT:
+        return None, source
+
+    if (cached['mtime_ns'], cached['size']) != (source['mtime_ns'],
+                                                source['size']):
+        source['sha256'] = file_hash(filename)
+        if cached['sha256'] != source['sha256']:
+            return None, source
+        # touched but unchanged: remember the new mtime
+        with open(os.path.join(path, "source.json"), "w") as outfile:
+            json.dump({'format': CACHE_FORMAT, **source}, outfile)
+    try:
+        race = {column: np.load(os.path.join(path, column + ".npy"),
+                                mmap_mode='r')
+                for column in RACE_COLUMNS}
+    except (OSError, ValueError):
+        return None, source
+    return race, source
+
+def read_race(filename, use_cache=True):
+    '''
+    The columns of a csv file (see load_race), from its binary cache in
+    CACHE_DIR when that is up to date. Otherwise the csv is parsed and the
+    cache rebuilt; if the cache cannot be written the parsed columns are
+    still returned
+    Parameters: filename (string), use_cache (boolean)
+    Return: dictionary (see load_race)
+    '''
+    if not use_cache:
+        return load_race(filename)
+    race, source = load_race_cache(filename)
+    if race is not None:
+        return race
+    race = load_race(filename)
+    if 'sha256' not in source:
+        source['sha256'] = file_hash(filename)
+    try:
+        save_race_cache(filename, race, source)
+    except OSError:
+        pass
+    return race
+
+class RaceData:
+    '''
+    The marathon results of a list of files, looked up by year. A file is
+    read (see read_race) the first time it is used and only read again if
+    it has changed on disk since
+    '''
+    # filename -> ((mtime, size), columns), shared by every instance
+    _races = {}
+    # read through the binary cache (see read_race)
+    use_cache = True
+
+    def __init__(self, files):
+        '''
+        Parameter: files (list of filenames)
+        '''
+        self.files = file_sorted_dct(files)
+        # (file stamps, by, filters) -> GroupStats
+        self._stats = {}
+        self._stacked = None
+
+    @classmethod
+    def race(cls, filename):
+        '''
+        The columns of one file, from memory unless the file has changed
+        Parameter: filename (string)
+        Return: dictionary (see load_race)
+        '''
+        info = os.stat(filename)
+        stamp = (info.st_mtime_ns, info.st_size)
+        cached = cls._races.get(filename)
+        if cached is None or cached[0] != stamp:
+            cached = (stamp, read_race(filename, cls.use_cache))
+            cls._races[filename] = cached
+        return cached[1]
+
+    def __getitem__(self, year):
+        return self.race(self.files[str(year)])
+
+    def years(self):
+        '''
+        Return: list of the years, in ascending order
+        '''
+        return list(self.files)
+
+    def items(self):
+        '''
+        Return: (year, columns) for every year, in ascending order
+        '''
+        for year in self.files:
+            yield year, self[year]
+
+    def stamps(self):
+        '''
+        Return: tuple of (mtime, size) of every file, which changes
+                whenever one of them is edited
+        '''
+        stamps = []
+        for filename in self.files.values():
+            info = os.stat(filename)
+            stamps.append((info.st_mtime_ns, info.st_size))
+        return tuple(stamps)
+
+    def stacked(self):
+        '''
+        Every year's finishers in one set of columns (see stack_races),
+        rebuilt only when a file changes
+        Return: dictionary
+        '''
+        stamps = self.stamps()
+        if self._stacked is None or self._stacked[0] != stamps:
+            self._stacked = (stamps, stack_races(self.items()))
+            self._stats.clear()
+        return self._stacked[1]
+
+    def group_by(self, by=('year',), only=None, exclude=None):
+        '''
+        Count, mean, median and mode of the finishers in every group, for
+        all years at once (see group_stats). Results are kept until a
+        file changes
+        Parameters: by (tuple of 'year', 'gender', 'country'),
+                    only (dictionary of column -> value the rows must have),
+                    exclude (dictionary of column -> value they must not)
+        Return: GroupStats
+        Ex: data.group_by(('year', 'gender'), exclude={'country': 'USA'})
+        '''
+        by = (by,) if isinstance(by, str) else tuple(by)
+        stacked = self.stacked()
+        key = (by, tuple(sorted((only or {}).items())),
+               tuple(sorted((exclude or {}).items())))
+        if key not in self._stats:
+            self._stats[key] = group_stats(stacked, by, only, exclude)
+        return self._stats[key]
+
+_datasets = {}
+
+def race_data(files):
+    '''
+    The shared RaceData of a list of files, so that every question asked
+    about the same files uses the same parsed columns
+    Parameter: files (file_lst)
+    Return: RaceData
+    '''
+    key = tuple(files)
+    if key not in _datasets:
+        _datasets[key] = RaceData(files)
+    return _datasets[key]
+
+def is_category(codes, categories, value):
+    '''
+    Find which rows of a categorical column hold the given value
+    Parameters: codes (array), categories (array), value (string)
+    Return: boolean array
+    '''
+    matches = np.flatnonzero(categories == value)
+    if len(matches) == 0:
+        return np.zeros(len(codes), dtype=bool)
+    return codes == matches[0]
+
+def stack_races(races):
+    '''
+    Concatenate the columns of many races into one set of columns with a
+    year column. Gender and country codes are renumbered into categories
+    shared by all years
+    Parameter: races ((year, columns) pairs, e.g. RaceData.items())
+    Return: dictionary like load_race, plus 'year' (int32 array)
+    '''
+    years, parts = [], []
+    for year, race in races:
+        years.append(np.full(len(race['seconds']), int(year), dtype=np.int32))
+        parts.append(race)
+    stacked = {'year': np.concatenate(years) if years
+               else np.empty(0, dtype=np.int32)}
+    for column in ('seconds', 'age'):
+        stacked[column] = (np.concatenate([race[column] for race in parts])
+                           if parts else np.empty(0))
+    for column, names in (('gender', 'genders'), ('country', 'countries')):
+        if not parts:
+            stacked[column] = np.empty(0, dtype=np.int32)
+            stacked[names] = np.empty(0, dtype=str)
+            continue
+        # map every year's categories to their code in the shared ones
+        local = [race[names] for race in parts]
+        mapping, stacked[names] = categorical(np.concatenate(local))
+        offsets = np.cumsum([0] + [len(names_) for names_ in local])
+        stacked[column] = np.concatenate(
+            [mapping[offsets[i]:offsets[i + 1]][race[column]]
+             for i, race in enumerate(parts)]).astype(np.int32)
+    return stacked
+
+class GroupStats:
+    '''
+    Summary statistics of every group of finishers, as arrays with one
+    entry per group (see group_stats)
+    '''
+
+    def __init__(self, by, keys, columns):
+        '''
+        Parameters: by (tuple of key column names), keys (list of tuples,
+                    one per group, in ascending order), columns (dictionary
+                    of statistic name -> array)
+        '''
+        self.by = by
+        self.keys = keys
+        self.columns = columns
+        self.index = {key: i for i, key in enumerate(keys)}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return self._key(key) in self.index
+
+    def _key(self, key):
+        return key if isinstance(key, tuple) else (key,)
+
+    def __getitem__(self, key):
+        '''
+        The statistics of one group. A single key (like a year) can be
+        given without a tuple when grouping by one column
+        Ex: data.group_by()[2013]['mean seconds']
+        '''
+        row = self.index[self._key(key)]
+        return {name: column[row].item() if isinstance(column, np.ndarray)
+                else column[row] for name, column in self.columns.items()}
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+def _first_index(ids, size):
+    '''
+    Position of the first occurrence of every id in 0..size-1 (len(ids)
+    where an id does not occur)
+    '''
+    first = np.full(size, len(ids), dtype=np.int64)
+    # with repeated indices the last assignment wins, so go backwards
+    first[ids[::-1]] = np.arange(len(ids) - 1, -1, -1)
+    return first
+
+def _group_medians(values, groups, starts, count):
+    '''
+    Median of values within each group; groups numbers the group of
+    every value, starts/count say where each group begins once sorted
+    '''
+    # sort by value once, then by group keeping that order: sorting one
+    # int64 key of (group, rank of value) beats a two-key lexsort
+    order = np.argsort(values)
+    keys = groups.astype(np.int64)[order] * len(values) + np.arange(len(values))
+    ordered = values[order][np.sort(keys) % max(len(values), 1)]
+    ordered = ordered.astype(np.float64)
+    low = ordered[starts + (count - 1) // 2]
+    high = ordered[starts + count // 2]
+    return (low + high) / 2
+
+def _group_modes(codes, groups, n_groups, n_codes):
+    '''
+    Most common code within each group. Ties go to the code that appears
+    first in the group, the same tie-break as statistics.mode
+    '''
+    pairs = groups.astype(np.int64) * n_codes + codes
+    if n_groups * n_codes <= 1 << 22:
+        # small enough for a groups x codes table
+        counts = np.bincount(pairs, minlength=n_groups * n_codes)
+        counts = counts.reshape(n_groups, n_codes)
+        first = _first_index(pairs, n_groups * n_codes).reshape(n_groups,
+                                                                n_codes)
+        tied = counts == counts.max(axis=1, keepdims=True)
+        return np.where(tied, first, len(pairs)).argmin(axis=1)
+    pairs, first, counts = np.unique(pairs, return_index=True,
+                                     return_counts=True)
+    pair_groups = pairs // n_codes
+    order = np.lexsort((first, -counts, pair_groups))
+    starts = np.searchsorted(pair_groups[order], np.arange(n_groups))
+    return pairs[order[starts]] % n_codes
+
+def group_stats(stacked, by=('year',), only=None, exclude=None):
+    '''
+    Group the finishers of stacked races by some of their columns and find,
+    for every group at once: the count, the mean and median of the finish
+    seconds and of the age, and the mode of gender and country
+    Parameters: stacked (dictionary, see stack_races),
+                by (tuple of 'year', 'gender', 'country'),
+                only, exclude (dictionaries of column -> value to keep
+                only those rows, or to leave out)
+    Return: GroupStats with the statistics 'count', 'mean seconds',
+            'median seconds', 'mean age', 'median age', 'mode gender' and
+            'mode country'
+    '''
+    names = {'gender': 'genders', 'country': 'countries'}
+    keep = np.ones(len(stacked['year']), dtype=bool)
+    for filters, wanted in ((only, True), (exclude, False)):
+        for column, value in (filters or {}).items():
+            if column in names:
+                matches = is_category(stacked[column], stacked[names[column]],
+                                      value)
+            else:
+                matches = stacked[column] == value
+            keep &= matches if wanted else ~matches
+    rows = {column: stacked[column][keep]
+            for column in ('year', 'seconds', 'age', 'gender', 'country')}
+
+    # one integer per row identifying its group, in mixed radix of the keys
+    code = np.zeros(len(rows['year']), dtype=np.int64)
+    for column in by:
+        values = rows[column].astype(np.int64)
+        base = int(values.min()) if len(values) else 0
+        radix = int(values.max()) - base + 1 if len(values) else 1
+        code = code * radix + (values - base)
+    # number the groups that occur 0, 1, 2, ... in order of their code
+    sizes = np.bincount(code)
+    groups = (np.cumsum(sizes > 0) - 1)[code]
+    count = sizes[sizes > 0]
+    first = _first_index(groups, len(count))
+    starts = np.cumsum(count) - count
+
+    keys = []
+    key_columns = [rows[column][first] for column in by]
+    for values in zip(*key_columns):
+        keys.append(tuple(str(stacked[names[column]][value])
+                          if column in names else int(value)
+                          for column, value in zip(by, values)))
+    if not by:
+        keys = [()] * len(count)
+
+    columns = {'count': count.astype(np.int64)}
+    for column in ('seconds', 'age'):
+        # float64 sums of whole seconds are exact, so the means match
+        # summing the times one by one
+        sums = np.bincount(groups, weights=rows[column], minlength=len(count))
+        columns['mean ' + column] = sums / count
+        columns['median ' + column] = _group_medians(rows[column], groups,
+                                                     starts, count)
+    for column in ('gender', 'country'):
+        modes = _group_modes(rows[column], groups, len(count),
+                             max(len(stacked[names[column]]), 1))
+        columns['mode ' + column] = [str(name) for name in
+                                     stacked[names[column]][modes]]
+    return GroupStats(tuple(by), keys, columns)
+
 def mean_finish(files, year):
     '''
     Given the data find the mean finish time of the give year file
@@ -139,22 +709,8 @@ def mean_finish(files, year):
     Return: time (HH:MM:SS)
     
     '''
-    time_lst = []
-    seconds_lst = []
-    # extract the OfficialTime column data
-    for i in dir_dct(file_sorted_dct(files)[str(year)])['OfficialTime']:
-    # turn to a 2d list where each row is in the [HH, MM, SS] form of the time
-        time_lst.append(i.split(':'))
-    # turn all the string number to number
-    for row in time_lst:
-        hours, minutes, seconds = map(int, row)  
-        total_seconds = hours * 3600 + minutes * 60 + seconds
-        seconds_lst.append(total_seconds)
-    seconds = round(statistics.mean(seconds_lst))
-    hours = seconds // 3600
-    minutes = (seconds % 3600) // 60
-    remaining_seconds = seconds % 60
-    return str(hours) + ':' + str(minutes) + ':' + str(remaining_seconds)
+    return seconds_to_time(race_data(files).group_by()[int(year)]
+                           ['mean seconds'])
     
 def median_age(files, year):
     '''
@@ -163,10 +719,7 @@ def median_age(files, year):
     Return: float
     
     '''
-    new_age_lst =[]
-    for i in dir_dct(file_sorted_dct(files)[str(year)])['AgeOnRaceDay']:
-        new_age_lst.append(float(i))
-    return statistics.median(new_age_lst)
+    return race_data(files).group_by()[int(year)]['median age']
 
 def most_runner_country(files, year):
     '''
@@ -176,11 +729,12 @@ def most_runner_country(files, year):
     Return: string
     
     '''
-    new_country_lst =[]
-    for i in dir_dct(file_sorted_dct(files)[str(year)])['CountryOfResAbbrev']:
-        if i != "USA":
-            new_country_lst.append(i)
-    return statistics.mode(new_country_lst)
+    data = race_data(files)
+    data.files[str(year)]  # KeyError for a year without a file
+    foreign = data.group_by(exclude={'country': "USA"})
+    if int(year) not in foreign:
+        raise statistics.StatisticsError('no mode for empty data')
+    return foreign[int(year)]['mode country']
 
 def total_woman_finished(files, year):
     '''
@@ -190,43 +744,31 @@ def total_woman_finished(files, year):
     Return: float
     
     '''
-    total_woman_lst =[]
-    for i in dir_dct(file_sorted_dct(files)[str(year)])['Gender']:
-        if i != "M":
-            total_woman_lst.append(i)
-    return len(total_woman_lst)
+    data = race_data(files)
+    data.files[str(year)]  # KeyError for a year without a file
+    women = data.group_by(exclude={'gender': "M"})
+    return women[int(year)]['count'] if int(year) in women else 0
 
 def woman_finish_time(filename):
     '''
     Given the filename, produce only the list of all womman's finish time 
     Parameter: filename (string)
-    Return: list
+    Return: list (of H:MM:SS times)
     
     '''
-    woman_finish_lst =[]
-    for p in range(len(dir_dct(filename)['Gender'])):
-        if dir_dct(filename)['Gender'][p] != "M":
-            woman_finish_lst.append(dir_dct(filename)['OfficialTime'][p])
-    return woman_finish_lst
+    race = RaceData.race(filename)
+    women = ~is_category(race['gender'], race['genders'], "M")
+    return official_times(race['seconds'][women]).tolist()
 
 def mean_lst(lst):
     '''
     Given the list of finish time, produce the mean 
-    Parameter: filename (string)
-    Return: float
+    Parameter: lst (list of times)
+    Return: float (seconds)
      
     '''
-    time_lst = []
-    total_seconds_lst = []
-    for i in lst:
-    # turn to a 2d list where each row is in the [HH, MM, SS] form of the time
-        time_lst.append(i.split(':'))
-    # turn all the string number to number
-    for row in time_lst:
-        hours, minutes, seconds = map(int, row)  
-        total_seconds = hours * 3600 + minutes * 60 + seconds
-        total_seconds_lst.append(total_seconds)
-    return sum(total_seconds_lst) / len(total_seconds_lst)   
+    # sum as integers so the result matches summing the times one by one
+    return int(np.sum(time_to_seconds(lst), dtype=np.int64)) / len(lst)
 
 def corr_woman_mean(files):
     '''
@@ -238,9 +780,9 @@ def corr_woman_mean(files):
     '''
     woman_finish_lst = []
     year_lst = []
-    # goes through all the filenames in the file_sorted_dct
-    for year,filename in file_sorted_dct(files).items():
-        woman_finish_lst.append(mean_lst(woman_finish_time(filename)))
+    women = race_data(files).group_by(exclude={'gender': "M"})
+    for year in race_data(files).years():
+        woman_finish_lst.append(women[int(year)]['mean seconds'])
         year_lst.append(int(year))
     return round(statistics.correlation(woman_finish_lst, year_lst), 4)
                    
@@ -249,14 +791,12 @@ def usa_finish_lst(filename):
     Given the filename, produce only the list of all American runners finish 
     time 
     Parameter: filename (string)
-    Return: list
+    Return: list (of H:MM:SS times)
     
     '''
-    usa_finish_time_lst =[]
-    for p in range(len(dir_dct(filename)['CountryOfResAbbrev'])):
-        if dir_dct(filename)['CountryOfResAbbrev'][p] == "USA":
-            usa_finish_time_lst.append(dir_dct(filename)['OfficialTime'][p])
-    return usa_finish_time_lst
+    race = RaceData.race(filename)
+    usa = is_category(race['country'], race['countries'], "USA")
+    return official_times(race['seconds'][usa]).tolist()
 
 def corr_usa_mean(files):
     '''
@@ -268,8 +808,8 @@ def corr_usa_mean(files):
     '''
     usa_lst = []
     year_lst = []
-    for year,filename in file_sorted_dct(files).items():
-        usa_lst.append(mean_lst(usa_finish_lst(filename)))
+    for year, mean in mean_lst_dct(files).items():
+        usa_lst.append(mean)
         year_lst.append(int(year))
     return round(statistics.correlation(usa_lst, year_lst), 4)
 
@@ -281,8 +821,9 @@ def mean_lst_dct(files):
     Return: dictionary
     '''
     mean_usa_finish_dct = {}
-    for year,filename in file_sorted_dct(files).items():
-        mean_usa_finish_dct[year] = mean_lst(usa_finish_lst(filename))
+    usa = race_data(files).group_by(only={'country': "USA"})
+    for year in race_data(files).years():
+        mean_usa_finish_dct[year] = usa[int(year)]['mean seconds']
     return mean_usa_finish_dct  
     
 def predict_mean(dct):
@@ -312,10 +853,7 @@ def predict_mean(dct):
     slope = sum(numerator_lst) / sum(denominator_lst)
     intercept = mean_finish - slope * mean_year
     predicted_value_2020 = slope * 2020 + intercept
-    hours = round(predicted_value_2020) // 3600
-    minutes = (round(predicted_value_2020) % 3600) // 60
-    remaining_seconds =  round(predicted_value_2020) % 60
-    return f'{hours}:{minutes}:{remaining_seconds}'
+    return seconds_to_time(predicted_value_2020)
     
 def plt1(dct):
     '''
@@ -373,17 +911,7 @@ def time_seconds(lst):
     Parameter: lst (list of time)
     Return: list
     '''
-    time_lst = []
-    total_seconds_lst = []
-    # turn to a 2d list where each row is in the [HH, MM, SS] form of the time
-    for i in lst:
-        time_lst.append(i.split(':'))
-    # turn all the string number to number
-    for row in time_lst:
-        hours, minutes, seconds = map(int, row)  
-        total_seconds = hours * 3600 + minutes * 60 + seconds
-        total_seconds_lst.append(total_seconds) 
-    return  total_seconds_lst
+    return time_to_seconds(lst).tolist()
     
 def plot2(dct):  
     '''
@@ -466,15 +994,5 @@ def main():
 #     over time.
     #plot2(perfect_dct)
     
-main()
-
-
-
-
-
-
-
-
-
-
-
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+Benchmark for Marathon_Analysis: how long it takes to get the parsed
+columns of every race file, cold (parsing the csv text) against warm
+(memory mapping the binary cache in marathon_data/.npcache), and to
+answer all the questions from a fresh start. With --scaling it instead
+writes a synthetic set of large races and times the per-year process
+pool of Marathon_Parallel against the serial path for several numbers
+of workers.
+
+    python Marathon_Benchmark.py --directory marathon_data --repeat 5
+    python Marathon_Benchmark.py --scaling --years 50 --runners 30000 \
+        --workers 1 2 4 8
+"""
+
+import argparse
+import csv
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import Marathon_Analysis as ma
+import Marathon_Parallel as mp
+
+HEADER = ["BibNumber", "FullName", "SortName", "AgeOnRaceDay", "Gender",
+          "City", "StateAbbrev", "StateName", "Zip", "CountryOfResAbbrev",
+          "CountryOfResName", "CountryOfCtzAbbrev", "CountryOfCtzName",
+          "OfficialTime", "RankOverall", "RankOverGender", "RankOverDivision",
+          "EventGroup", "SubGroupLabel", "SubGroup"]
+COUNTRIES = ["USA"] * 70 + ["CAN"] * 8 + ["GBR", "MEX", "KEN", "ETH", "JPN",
+             "GER", "FRA", "ITA", "BRA", "CHN", "AUS", "IRL"] * 2
+
+
+def best_time(func, repeat):
+    '''
+    Run func repeat times and return the fastest run in seconds
+    Parameters: func (function without arguments), repeat (int)
+    Return: float
+    '''
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def load_all(files, use_cache):
+    '''
+    Read every file's columns, touching each column so memory mapped
+    arrays are really read
+    Parameters: files (file_lst), use_cache (boolean)
+    '''
+    for filename in files:
+        race = ma.read_race(filename, use_cache)
+        for column in ma.RACE_COLUMNS:
+            race[column].copy()
+
+def answer_all(files, use_cache):
+    '''
+    Answer the homework questions from nothing in memory
+    Parameters: files (file_lst), use_cache (boolean)
+    '''
+    ma.RaceData._races.clear()
+    ma._datasets.clear()
+    ma.RaceData.use_cache = use_cache
+    try:
+        for year in ma.race_data(files).years():
+            ma.mean_finish(files, year)
+            ma.median_age(files, year)
+            ma.most_runner_country(files, year)
+            ma.total_woman_finished(files, year)
+        ma.corr_woman_mean(files)
+        ma.corr_usa_mean(files)
+        ma.predict_mean(ma.mean_lst_dct(files))
+    finally:
+        ma.RaceData.use_cache = True
+
+def make_race_files(directory, years=50, runners=30000, seed=0):
+    '''
+    Write synthetic result files shaped like the real ones, one per year
+    from 1970 on, with finish times getting slowly faster over the years
+    Parameters: directory (string), years (int), runners (int per year),
+                seed (int)
+    Return: list of the filenames written
+    '''
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok=True)
+    files = []
+    for i in range(years):
+        year = 1970 + i
+        seconds = np.sort(rng.normal(14000 - 20 * i, 2500, runners)
+                          .clip(7200, 30000).astype(np.int64))
+        ages = rng.integers(18, 80, runners)
+        genders = rng.choice(["M", "F"], runners, p=[0.55, 0.45])
+        countries = rng.choice(COUNTRIES, runners)
+        times = ma.official_times(seconds)
+        filename = os.path.join(directory, f"boston_marathon_{year}.csv")
+        with open(filename, "w", newline="") as outfile:
+            writer = csv.writer(outfile)
+            writer.writerow(HEADER)
+            for rank in range(runners):
+                writer.writerow([rank + 1, "", "", ages[rank], genders[rank],
+                                 "", "", "", "", countries[rank], "",
+                                 countries[rank], "", times[rank], rank + 1,
+                                 "", "", "Runners", "", ""])
+        files.append(filename)
+    return files
+
+def scaling(years, runners, worker_counts, repeat):
+    '''
+    Time the questions that go year by year (the USA means by year and
+    both correlations) serially and with Marathon_Parallel.year_answers on
+    synthetic data, checking that every run gives the same answers
+    Parameters: years, runners (size of the synthetic data), worker_counts
+                (list of int), repeat (int)
+    '''
+    def serial(use_cache):
+        ma.RaceData._races.clear()
+        ma._datasets.clear()
+        ma.RaceData.use_cache = use_cache
+        try:
+            return (ma.mean_lst_dct(files), ma.corr_woman_mean(files),
+                    ma.corr_usa_mean(files))
+        finally:
+            ma.RaceData.use_cache = True
+
+    def parallel(workers, use_cache):
+        return mp.year_answers(files, workers, use_cache)
+
+    directory = tempfile.mkdtemp(prefix="marathon_scaling_")
+    try:
+        start = time.perf_counter()
+        files = make_race_files(directory, years, runners)
+        print(f"{years} years x {runners} runners written in "
+              f"{time.perf_counter() - start:.1f} s, "
+              f"{os.cpu_count()} cpus, best of {repeat}")
+        expected = serial(True)  # also builds the binary cache
+
+        rows = [("serial, group-by", lambda: serial(False),
+                 lambda: serial(True))]
+        for workers in worker_counts:
+            rows.append((f"parallel, {workers} workers",
+                         lambda w=workers: parallel(w, False),
+                         lambda w=workers: parallel(w, True)))
+        print(f"{'':<26}{'cold csv':>12}{'warm binary':>14}")
+        for name, cold, warm in rows:
+            for run in (cold, warm):
+                if run() != expected:
+                    raise AssertionError(f"{name} gave different answers")
+            print(f"{name:<26}{best_time(cold, repeat):11.2f}s"
+                  f"{best_time(warm, repeat):13.2f}s")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--directory", default="marathon_data")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--scaling", action="store_true",
+                        help="benchmark Marathon_Parallel on synthetic data")
+    parser.add_argument("--years", type=int, default=50)
+    parser.add_argument("--runners", type=int, default=30000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args(argv)
+
+    if args.scaling:
+        scaling(args.years, args.runners, args.workers, args.repeat)
+        return
+
+    files = ma.get_filenames(args.directory)
+    # build the cache once so the warm runs find it
+    shutil.rmtree(os.path.join(args.directory, ma.CACHE_DIR),
+                  ignore_errors=True)
+    build = best_time(lambda: load_all(files, True), 1)
+
+    results = {
+        "cold csv load": best_time(lambda: load_all(files, False),
+                                   args.repeat),
+        "cache build (first run)": build,
+        "warm binary load": best_time(lambda: load_all(files, True),
+                                      args.repeat),
+        "all questions, cold csv": best_time(lambda: answer_all(files, False),
+                                             args.repeat),
+        "all questions, warm binary": best_time(
+            lambda: answer_all(files, True), args.repeat),
+    }
+    print(f"{len(files)} files, best of {args.repeat}")
+    for name, seconds in results.items():
+        print(f"{name:<28}{seconds * 1000:10.2f} ms")
+    print(f"warm load speedup: "
+          f"{results['cold csv load'] / results['warm binary load']:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Parallel per-year execution for Marathon_Analysis. Every race file is
+loaded and reduced to a small RaceSummary (see Marathon_Streaming) in
+its own worker process and only the summaries come back, so the answers
+are the same as the serial functions in Marathon_Analysis. year_answers
+gets all of them from one pass over the files.
+
+    import Marathon_Parallel as mp
+    mp.corr_usa_mean(files, workers=4)
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import os
+import statistics
+
+import Marathon_Analysis as ma
+import Marathon_Streaming as ms
+
+
+def summarize_year(job):
+    '''
+    Load one race file and reduce it to a RaceSummary, in a worker process
+    Parameter: job (tuple of year, filename, use_cache, width)
+    Return: RaceSummary
+    '''
+    year, filename, use_cache, width = job
+    race = ma.read_race(filename, use_cache)
+    summary = ms.RaceSummary(int(year), width)
+    summary.update({'seconds': race['seconds'],
+                    'age': race['age'],
+                    'gender': race['genders'][race['gender']],
+                    'country': race['countries'][race['country']]})
+    return summary
+
+def year_summaries(files, workers=None, use_cache=True, width=1.0):
+    '''
+    Summarize every year's race, one year per task in a process pool
+    Parameters: files (file_lst), workers (number of processes, default
+                os.cpu_count(); 1 runs in this process), use_cache (read
+                through the binary cache, see read_race), width (bin width
+                of the median age sketch)
+    Return: dictionary of year (string) -> RaceSummary, in year order
+    '''
+    sorted_files = ma.file_sorted_dct(files)
+    jobs = [(year, filename, use_cache, width)
+            for year, filename in sorted_files.items()]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(jobs))
+    if workers <= 1:
+        summaries = map(summarize_year, jobs)
+        return dict(zip(sorted_files, summaries))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # a few years per message keeps the pool busy without much pickling
+        chunksize = max(1, len(jobs) // (workers * 4))
+        return dict(zip(sorted_files, pool.map(summarize_year, jobs,
+                                                chunksize=chunksize)))
+
+def usa_means(summaries):
+    '''
+    Parameter: summaries (dictionary of year -> RaceSummary)
+    Return: dictionary of year -> mean finish seconds of USA runners
+    '''
+    return {year: summary.usa.mean() for year, summary in summaries.items()}
+
+def woman_means(summaries):
+    '''
+    Parameter: summaries (dictionary of year -> RaceSummary)
+    Return: dictionary of year -> mean finish seconds of women
+    '''
+    return {year: summary.women.mean() for year, summary in summaries.items()}
+
+def year_correlation(means):
+    '''
+    Correlation of year vs. the values of a dictionary of year -> mean
+    Parameter: means (dictionary)
+    Return: float
+    '''
+    return round(statistics.correlation(list(means.values()),
+                                        [int(year) for year in means]), 4)
+
+def mean_lst_dct(files, workers=None, use_cache=True):
+    '''
+    Same as Marathon_Analysis.mean_lst_dct, one process per year
+    Parameters: files (file_lst), workers (number of processes), use_cache
+                (read through the binary cache)
+    Return: dictionary of year -> mean finish seconds of USA runners
+    '''
+    return usa_means(year_summaries(files, workers, use_cache))
+
+def corr_woman_mean(files, workers=None, use_cache=True):
+    '''
+    Same as Marathon_Analysis.corr_woman_mean, one process per year
+    Parameters: files (file_lst), workers (number of processes), use_cache
+                (read through the binary cache)
+    Return: float
+    '''
+    return year_correlation(woman_means(year_summaries(files, workers,
+                                                       use_cache)))
+
+def corr_usa_mean(files, workers=None, use_cache=True):
+    '''
+    Same as Marathon_Analysis.corr_usa_mean, one process per year
+    Parameters: files (file_lst), workers (number of processes), use_cache
+                (read through the binary cache)
+    Return: float
+    '''
+    return year_correlation(mean_lst_dct(files, workers, use_cache))
+
+def year_answers(files, workers=None, use_cache=True):
+    '''
+    The answers of mean_lst_dct, corr_woman_mean and corr_usa_mean from a
+    single pass of the process pool over the files
+    Parameters: files (file_lst), workers (number of processes), use_cache
+                (read through the binary cache)
+    Return: tuple of the three answers, in that order
+    '''
+    summaries = year_summaries(files, workers, use_cache)
+    means = usa_means(summaries)
+    return (means, year_correlation(woman_means(summaries)),
+            year_correlation(means))
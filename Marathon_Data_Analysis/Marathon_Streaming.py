@@ -0,0 +1,320 @@
+"""
+Streaming mode for Marathon_Analysis, for full fields of tens of
+thousands of runners a year over many years. Each csv is read in
+batches of rows that are folded into small running accumulators and
+then dropped, so memory stays the same however large the files are:
+running sums for the means, co-moments for the correlation and the
+regression line, a Counter of countries and a histogram sketch for the
+median age.
+
+    python Marathon_Streaming.py --directory marathon_data --batch-size 10000
+"""
+
+import argparse
+import csv
+from collections import Counter
+import itertools
+import math
+
+import numpy as np
+
+import Marathon_Analysis as ma
+
+
+def read_batches(filename, batch_size=10000):
+    '''
+    Read a marathon csv file batch_size rows at a time
+    Parameters: filename (string), batch_size (int)
+    Return: generator of dictionaries with the columns of one batch:
+            'seconds' (int32 array), 'age' (float array), 'gender' and
+            'country' (string arrays)
+    '''
+    with open(filename, "r") as infile:
+        csvfile = csv.reader(infile)
+        header = next(csvfile)
+        columns = [header.index(name) for name in
+                   ('OfficialTime', 'AgeOnRaceDay', 'Gender',
+                    'CountryOfResAbbrev')]
+        while True:
+            rows = list(itertools.islice(csvfile, batch_size))
+            if not rows:
+                return
+            times, ages, genders, countries = (
+                [row[i] for row in rows] for i in columns)
+            yield {'seconds': ma.time_to_seconds(times),
+                   'age': np.array(ages, dtype=np.float64),
+                   'gender': np.array(genders, dtype=str),
+                   'country': np.array(countries, dtype=str)}
+
+
+class RunningMean:
+    '''
+    Count and sum of a stream of numbers. Whole numbers are summed exactly,
+    so the mean is the same as summing them all at once
+    '''
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+
+    def update(self, values):
+        '''
+        Parameter: values (array of numbers)
+        '''
+        values = np.asarray(values)
+        dtype = np.int64 if values.dtype.kind in "biu" else np.float64
+        self.count += len(values)
+        self.total += values.sum(dtype=dtype).item()
+
+    def merge(self, other):
+        '''
+        Add in the numbers seen by another RunningMean
+        '''
+        self.count += other.count
+        self.total += other.total
+
+    def mean(self):
+        '''
+        Return: float
+        '''
+        return self.total / self.count
+
+
+class RunningRegression:
+    '''
+    Least squares line and correlation of a stream of (x, y) pairs, kept
+    as means and co-moments that are updated a batch at a time (Chan et
+    al.'s pairwise update), which stays accurate for large x like years
+    '''
+
+    def __init__(self):
+        self.count = 0
+        self.mean_x = 0.0
+        self.mean_y = 0.0
+        self.sxx = 0.0
+        self.syy = 0.0
+        self.sxy = 0.0
+
+    def _combine(self, count, mean_x, mean_y, sxx, syy, sxy):
+        total = self.count + count
+        if total == 0:
+            return
+        dx = mean_x - self.mean_x
+        dy = mean_y - self.mean_y
+        weight = self.count * count / total
+        self.sxx += sxx + dx * dx * weight
+        self.syy += syy + dy * dy * weight
+        self.sxy += sxy + dx * dy * weight
+        self.mean_x += dx * count / total
+        self.mean_y += dy * count / total
+        self.count = total
+
+    def update(self, x, y):
+        '''
+        Parameters: x, y (arrays or lists of numbers of the same length)
+        '''
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        if len(x) == 0:
+            return
+        dx = x - x.mean()
+        dy = y - y.mean()
+        self._combine(len(x), x.mean(), y.mean(), (dx * dx).sum(),
+                      (dy * dy).sum(), (dx * dy).sum())
+
+    def merge(self, other):
+        '''
+        Add in the pairs seen by another RunningRegression
+        '''
+        self._combine(other.count, other.mean_x, other.mean_y, other.sxx,
+                      other.syy, other.sxy)
+
+    def correlation(self):
+        '''
+        Return: float (Pearson's r)
+        '''
+        return self.sxy / math.sqrt(self.sxx * self.syy)
+
+    def slope(self):
+        return self.sxy / self.sxx
+
+    def intercept(self):
+        return self.mean_y - self.slope() * self.mean_x
+
+    def predict(self, x):
+        '''
+        Parameter: x (number)
+        Return: float (the y of the regression line at x)
+        '''
+        return self.slope() * x + self.intercept()
+
+
+class QuantileSketch:
+    '''
+    Fixed size histogram of a stream of numbers for estimating quantiles.
+    Values are rounded to the nearest multiple of width (and clamped to
+    [low, high]), so quantiles are within width / 2 of the true ones, and
+    exact when every value is a multiple of width, like ages in whole
+    years with the default width of 1
+    '''
+
+    def __init__(self, width=1.0, low=0.0, high=130.0):
+        self.width = width
+        self.low = low
+        self.counts = np.zeros(int(math.ceil((high - low) / width)) + 1,
+                               dtype=np.int64)
+
+    def add(self, values):
+        '''
+        Parameter: values (array of numbers; NaN is skipped)
+        '''
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        bins = np.clip(np.rint((values - self.low) / self.width), 0,
+                       len(self.counts) - 1).astype(np.int64)
+        self.counts += np.bincount(bins, minlength=len(self.counts))
+
+    def merge(self, other):
+        '''
+        Add in the values seen by another sketch with the same bins
+        '''
+        if (other.width, other.low, len(other.counts)) != \
+                (self.width, self.low, len(self.counts)):
+            raise ValueError("cannot merge sketches with different bins")
+        self.counts += other.counts
+
+    def __len__(self):
+        return int(self.counts.sum())
+
+    def _value(self, rank, cumulative):
+        return self.low + self.width * int(np.searchsorted(cumulative, rank,
+                                                           side="right"))
+
+    def quantile(self, q):
+        '''
+        Estimate a quantile, interpolating between the two nearest values
+        like statistics.median does for an even count
+        Parameter: q (float between 0 and 1)
+        Return: float
+        '''
+        n = len(self)
+        if n == 0:
+            raise ValueError("no values")
+        cumulative = np.cumsum(self.counts)
+        rank = q * (n - 1)
+        below = self._value(math.floor(rank), cumulative)
+        above = self._value(math.ceil(rank), cumulative)
+        return below + (above - below) * (rank - math.floor(rank))
+
+    def median(self):
+        return self.quantile(0.5)
+
+
+class RaceSummary:
+    '''
+    Everything the questions need from one race, built from batches of
+    rows (see read_batches) without keeping the rows
+    '''
+
+    def __init__(self, year, width=1.0):
+        '''
+        Parameters: year (int), width (float, bin width of the age sketch)
+        '''
+        self.year = year
+        self.finish = RunningMean()
+        self.women = RunningMean()
+        self.usa = RunningMean()
+        self.ages = QuantileSketch(width)
+        # in order of first appearance, so most_common breaks ties the
+        # same way as statistics.mode
+        self.countries = Counter()
+
+    def update(self, batch):
+        '''
+        Parameter: batch (dictionary of columns, see read_batches)
+        '''
+        seconds = batch['seconds']
+        self.finish.update(seconds)
+        self.women.update(seconds[batch['gender'] != "M"])
+        self.usa.update(seconds[batch['country'] == "USA"])
+        self.ages.add(batch['age'])
+        self.countries.update(batch['country'][batch['country'] != "USA"]
+                              .tolist())
+
+    def merge(self, other):
+        '''
+        Add in a summary of more rows of the same race, which come after
+        the rows seen so far
+        '''
+        self.finish.merge(other.finish)
+        self.women.merge(other.women)
+        self.usa.merge(other.usa)
+        self.ages.merge(other.ages)
+        self.countries.update(other.countries)
+
+    def mean_finish(self):
+        return ma.seconds_to_time(self.finish.mean())
+
+    def median_age(self):
+        return self.ages.median()
+
+    def most_runner_country(self):
+        return self.countries.most_common(1)[0][0]
+
+    def total_woman_finished(self):
+        return self.women.count
+
+
+def summarize_race(filename, year, batch_size=10000, width=1.0):
+    '''
+    Stream one csv file into a RaceSummary
+    Parameters: filename (string), year (int), batch_size (int),
+                width (float, bin width of the age sketch)
+    Return: RaceSummary
+    '''
+    summary = RaceSummary(year, width)
+    for batch in read_batches(filename, batch_size):
+        summary.update(batch)
+    return summary
+
+def stream_answers(files, batch_size=10000, width=1.0):
+    '''
+    Answer the questions of Marathon_Analysis by streaming every file once
+    Parameters: files (file_lst), batch_size (int), width (float, bin
+                width of the age sketch)
+    Return: dictionary with 'races' (year -> RaceSummary), 'corr woman',
+            'corr usa' and 'predict 2020' (the answers to Q2.1 - Q2.3)
+    '''
+    races = {}
+    women_trend = RunningRegression()
+    usa_trend = RunningRegression()
+    for year, filename in ma.file_sorted_dct(files).items():
+        race = summarize_race(filename, int(year), batch_size, width)
+        races[int(year)] = race
+        women_trend.update([int(year)], [race.women.mean()])
+        usa_trend.update([int(year)], [race.usa.mean()])
+    return {'races': races,
+            'corr woman': round(women_trend.correlation(), 4),
+            'corr usa': round(usa_trend.correlation(), 4),
+            'predict 2020': ma.seconds_to_time(usa_trend.predict(2020))}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--directory", default="marathon_data")
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--age-bin", type=float, default=1.0,
+                        help="bin width of the median age sketch")
+    args = parser.parse_args(argv)
+
+    answers = stream_answers(ma.get_filenames(args.directory),
+                             args.batch_size, args.age_bin)
+    for year, race in answers['races'].items():
+        print(year, race.mean_finish(), race.median_age(),
+              race.most_runner_country(), race.total_woman_finished())
+    print("corr woman", answers['corr woman'])
+    print("corr usa", answers['corr usa'])
+    print("predict 2020", answers['predict 2020'])
+
+if __name__ == "__main__":
+    main()